@@ -21,12 +21,26 @@ Restrictions by design:
 Query language is SQL based.
 
 TODO?: make(storable_class, **field_values)
-TODO: logging
 '''
 
+import array
+import binascii
+import collections
 import contextlib
+import copy
+import csv
+import datetime
+import decimal
 import functools
+import itertools
+import json
+import logging
+import multiprocessing
+import random
+import re
 import sqlite3
+import threading
+import time
 import uuid
 
 
@@ -34,41 +48,861 @@ __all__ = (
     'db',
     'storable_pk_autoinc',
     'storable_pk_netaddrtime_uuid1', 'storable_pk_random_uuid4',
-    'Field',
+    'storable_pk_uuid7',
+    'storable_pk_binary_uuid4', 'storable_pk_binary_uuid7',
+    'Field', 'BlobField',
+    'DateTimeField', 'DecimalField', 'JSONField', 'BoolField', 'EnumField',
     # CRUD / Data Mapper functions
     'get', 'filter', 'save', 'create', 'delete', 'delete_but_keep_id',
+    'create_many', 'get_many', 'upsert', 'upsert_many',
+    'is_dirty', 'changed_fields', 'load_deferred',
+    'iter_pages', 'Page', 'filter_rows', 'filter_columns', 'parallel_map',
+    'update_where', 'delete_where',
+    'export_rows', 'import_rows',
+    'open_blob', 'iter_blob', 'write_blob', 'blob_size',
     # for more control and extras
-    'Database', 'database', 'table_name', 'sql_constraint',
-    'table_exists', 'create_table',
+    'Database', 'database', 'table_name', 'sql_constraint', 'sql_index',
+    'PROFILES',
+    'construct_with_init', 'compact',
+    'table_exists', 'create_table', 'ensure_indexes', 'SQLIndex',
     'get_storable',
     'PrimaryKey', 'UUIDPrimaryKey', 'AutoincrementPrimaryKey',
+    'BinaryUUIDPrimaryKey', 'uuid7',
+    'ObjectCache', 'ConnectionPool', 'QueryAdvisor', 'UnitOfWork',
+    'QueryEvent', 'QueryStats', 'SlowQueryLog',
     'IntegrityError',
 )
 
 
 AUTOCOMMIT = None
+# size of the per connection prepared statement cache in sqlite3
+CACHED_STATEMENTS = 256
+# number of rows fetched from a cursor at once when reading objects
+FETCH_BATCH_SIZE = 256
+# number of objects read by one query in iter_pages()
+PAGE_SIZE = 1000
+# rowid ranges scanned per worker process in parallel_map()
+RANGES_PER_WORKER = 4
+# default SQLITE_MAX_VARIABLE_NUMBER of sqlite before 3.32.0
+MAX_VARIABLE_NUMBER = 999
+# bytes read or written at once when streaming BLOBs
+BLOB_CHUNK_SIZE = 64 * 1024
 PK_FIELD = 'id'
+
+# Connection settings (PRAGMAs) in the order they are applied
+SETTINGS = (
+    'busy_timeout',
+    'journal_mode', 'synchronous',
+    'cache_size', 'mmap_size', 'temp_store',
+)
+# Named sets of settings for Database(profile=...)
+PROFILES = {
+    # every commit is on disk before it returns
+    'durable': dict(
+        busy_timeout=5000,
+        journal_mode='delete',
+        synchronous='full',
+    ),
+    # write ahead log, commits may be lost on power failure, never corrupt
+    'throughput': dict(
+        busy_timeout=5000,
+        journal_mode='wal',
+        synchronous='normal',
+        cache_size=-64 * 1024,  # KiB
+        mmap_size=256 * 1024 * 1024,
+        temp_store='memory',
+    ),
+    # as throughput, with more memory for caching and mapping
+    'read-mostly': dict(
+        busy_timeout=5000,
+        journal_mode='wal',
+        synchronous='normal',
+        cache_size=-256 * 1024,  # KiB
+        mmap_size=1024 * 1024 * 1024,
+        temp_store='memory',
+    ),
+}
 STORABLE_META_ATTR = '__omlite_meta'
+# (columns, row) as last read from or written to the database
+# - a slot in compact classes, hence no name mangling __ prefix
+LOADED_ROW_ATTR = '_omlite_loaded'
+# frozenset of fields not read yet, as they were deferred
+DEFERRED_ATTR = '__omlite_deferred'
 IntegrityError = sqlite3.IntegrityError
+# the type sqlite3 stores as BLOB
+BLOB = buffer if bytes is str else bytes  # noqa
+
+log = logging.getLogger(__name__)
+# best available timer for measuring elapsed time
+clock = getattr(time, 'perf_counter', time.time)
+
+
+class ObjectCache(object):
+    '''
+    LRU cache of database rows keyed by (storable class, id).
+
+    Rows are cached, not objects: every lookup returns a new object,
+    so changes not yet saved never leak into other readers.
+
+    Only committed rows are cached: rows written within a transaction
+    are evicted instead, and evicted again when the outermost
+    transaction ends.  Rows read within a transaction, or by a query
+    started before a write or an eviction, are not cached.
+    '''
+
+    def __init__(self, size):
+        assert size > 0
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # incremented on every write and explicit eviction, so that
+        # queries started before can not overwrite newer rows
+        self.generation = 0
+        self._rows = collections.OrderedDict()
+        self._lock = threading.RLock()
+        # per thread stack of keys written in open transactions
+        self._local = threading.local()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get(self, key):
+        ''' Return (columns, row) for :key or None '''
+        with self._lock:
+            try:
+                entry = self._rows.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._rows[key] = entry
+            self.hits += 1
+            return entry
+
+    def put(self, key, columns, row):
+        ''' Record a row written to the database '''
+        with self._lock:
+            journals = self._journals()
+            if journals:
+                journals[-1].add(key)
+                self._evict(key)
+            else:
+                self.generation += 1
+                self._put(key, columns, row)
+
+    def fill(self, key, columns, row, generation):
+        '''
+        Record a row read from the database by a query started
+        at :generation.
+        '''
+        with self._lock:
+            if generation == self.generation and not self._journals():
+                self._put(key, columns, row)
+
+    def evict(self, key):
+        with self._lock:
+            journals = self._journals()
+            if journals:
+                journals[-1].add(key)
+            self._evict(key)
+
+    def evict_table(self, table_name):
+        ''' Evict the rows of all storable classes stored in :table_name '''
+        with self._lock:
+            for key in list(self._rows):
+                storable_class, id = key
+                if get_class_meta(storable_class).table_name == table_name:
+                    self.evict(key)
+            self.generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+            self.generation += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                size=self.size,
+                length=len(self._rows),
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions)
+
+    def _put(self, key, columns, row):
+        self._rows.pop(key, None)
+        self._rows[key] = columns, row
+        if len(self._rows) > self.size:
+            self._rows.popitem(last=False)
+            self.evictions += 1
+
+    def _evict(self, key):
+        self._rows.pop(key, None)
+        self.generation += 1
+
+    # Transactions of the current thread
+    def _journals(self):
+        try:
+            return self._local.journals
+        except AttributeError:
+            journals = self._local.journals = []
+            return journals
+
+    def begin(self):
+        self._journals().append(set())
+
+    def end(self):
+        ''' Transaction is either released or rolled back '''
+        with self._lock:
+            journals = self._journals()
+            journal = journals.pop()
+            if journals:
+                journals[-1].update(journal)
+            else:
+                for key in journal:
+                    self._evict(key)
+
+
+QueryPlanAdvice = collections.namedtuple(
+    'QueryPlanAdvice', 'table predicate calls plan suggested_index')
+
+
+class QueryAdvisor(object):
+    '''
+    Finds predicates of filter() and get() that make sqlite scan tables.
+
+    The query plan of every distinct (table, predicate) is explained once,
+    calls are counted.
+    '''
+
+    # comparisons that an index on the left hand side column can serve
+    EQUALITY_RE = re.compile(r'(\w+)\s*(?:==?|\bIN\b|\bIS\b)', re.I)
+    RANGE_RE = re.compile(
+        r'(\w+)\s*(?:<=?|>=?|\bBETWEEN\b|\bLIKE\b|\bGLOB\b)', re.I)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = collections.defaultdict(int)
+        self._plans = {}
+        self._fields = {}
+
+    def observe(self, database, meta, sql_predicate, sql, params):
+        key = meta.table_name, str(sql_predicate)
+        with self._lock:
+            self._calls[key] += 1
+            if key in self._plans:
+                return
+            self._plans[key] = None
+
+        explained = database.connection.execute(
+            'EXPLAIN QUERY PLAN ' + sql, params)
+        # detail is the last column in all sqlite versions
+        plan = tuple(row[-1] for row in explained)
+        with self._lock:
+            self._plans[key] = plan
+            self._fields[key] = meta.fields
+
+    def report(self):
+        '''
+        Return QueryPlanAdvice for all predicates causing table scans,
+        most frequently called first.
+        '''
+        with self._lock:
+            scans = [
+                (key, plan) for key, plan in self._plans.items()
+                if plan and any(step.startswith('SCAN') for step in plan)]
+            advices = [
+                QueryPlanAdvice(
+                    table, predicate, self._calls[table, predicate], plan,
+                    self.suggest_index(
+                        table, predicate, self._fields[table, predicate]))
+                for (table, predicate), plan in scans]
+        return sorted(advices, key=lambda advice: -advice.calls)
+
+    def suggest_index(self, table, sql_predicate, fields):
+        '''
+        CREATE INDEX statement on the fields compared in :sql_predicate,
+        equality comparisons first, or None.
+        '''
+        columns = []
+        for regex in (self.EQUALITY_RE, self.RANGE_RE):
+            for column in regex.findall(sql_predicate):
+                if column in fields and column not in columns:
+                    columns.append(column)
+        if not columns:
+            return None
+        return SQLIndex(', '.join(columns)).get_sql(table)
+
+
+class QueryEvent(collections.namedtuple(
+        'QueryEvent', 'operation table sql params elapsed rows')):
+    '''
+    A statement executed by a Database, as passed to its hooks.
+
+    operation: get, filter, create, update, upsert, delete, blob, export,
+    sql
+    or commit/rollback for transactions (with sql and params None)
+    table: table name, None if not known
+    elapsed: seconds spent in sqlite executing and fetching
+    rows: rows fetched, or changed by INSERT/UPDATE/DELETE
+    '''
+    __slots__ = ()
+
+
+class QueryStats(object):
+    '''
+    Hook aggregating counts, rows and latency histograms
+    per (table, operation).
+
+        stats = db.add_hook(QueryStats())
+        ...
+        stats.report()
+    '''
+
+    # upper bounds of histogram buckets in seconds, the last is unbounded
+    BUCKETS = (0.0001, 0.001, 0.01, 0.1, 1.0, float('inf'))
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._stats = {}
+
+    def __call__(self, event):
+        key = event.table, event.operation
+        with self._lock:
+            stat = self._stats.get(key)
+            if stat is None:
+                stat = self._stats[key] = {
+                    'count': 0, 'rows': 0, 'elapsed': 0.0, 'max': 0.0,
+                    'histogram': [0] * len(self.BUCKETS)}
+            stat['count'] += 1
+            stat['rows'] += event.rows
+            stat['elapsed'] += event.elapsed
+            stat['max'] = max(stat['max'], event.elapsed)
+            for i, bound in enumerate(self.BUCKETS):
+                if event.elapsed <= bound:
+                    stat['histogram'][i] += 1
+                    break
+
+    def report(self):
+        '''
+        Return {(table, operation): stat} where stat is a dict of
+        count, rows, elapsed (total), max, and histogram,
+        the number of events falling into each of BUCKETS.
+        '''
+        with self._lock:
+            return dict(
+                (key, dict(stat, histogram=list(stat['histogram'])))
+                for key, stat in self._stats.items())
+
+
+class SlowQueryLog(object):
+    '''
+    Hook logging statements slower than :threshold seconds
+    as warnings to :logger (default: the omlite logger).
+    '''
+
+    def __init__(self, threshold=0.1, logger=None):
+        self.threshold = threshold
+        self.logger = logger or log
+
+    def __call__(self, event):
+        if event.elapsed >= self.threshold:
+            self.logger.warning(
+                'slow %s on %s (%.3fs, %d rows): %s %r',
+                event.operation, event.table, event.elapsed, event.rows,
+                event.sql, event.params)
+
+
+class _InstrumentedCursor(object):
+    '''
+    Cursor proxy measuring the time spent in sqlite and counting rows.
+
+    The QueryEvent is emitted when the cursor is closed.
+    '''
+
+    def __init__(self, database, cursor, operation, table, sql, params):
+        self.database = database
+        self.cursor = cursor
+        self.operation = operation
+        self.table = table
+        self.sql = sql
+        self.params = params
+        self.elapsed = 0.0
+        self.rows = 0
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def execute(self, sql, params):
+        start = clock()
+        self.cursor.execute(sql, params)
+        self.elapsed += clock() - start
+
+    def executemany(self, sql, seq_of_params):
+        start = clock()
+        self.cursor.executemany(sql, seq_of_params)
+        self.elapsed += clock() - start
+
+    def fetchone(self):
+        start = clock()
+        row = self.cursor.fetchone()
+        self.elapsed += clock() - start
+        if row is not None:
+            self.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        start = clock()
+        if size is None:
+            rows = self.cursor.fetchmany()
+        else:
+            rows = self.cursor.fetchmany(size)
+        self.elapsed += clock() - start
+        self.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        start = clock()
+        rows = self.cursor.fetchall()
+        self.elapsed += clock() - start
+        self.rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(FETCH_BATCH_SIZE)
+            if not rows:
+                return
+            for row in rows:
+                yield row
+
+    def close(self):
+        cursor = self.cursor
+        rows = self.rows
+        if cursor.description is None:
+            rows = max(cursor.rowcount, 0)
+        cursor.close()
+        self.database._emit(QueryEvent(
+            self.operation, self.table, self.sql, self.params,
+            self.elapsed, rows))
+
+
+class Connection(sqlite3.Connection):
+    '''
+    sqlite3 connection with its own savepoint nesting state.
+    '''
+
+    open_transactions = 0
+
+
+class ConnectionPool(object):
+    '''
+    At most :size connections, each used by one thread at a time.
+
+    A thread gets a connection on first use and keeps it until it calls
+    release() or ends.  Threads wait for a free connection when all
+    :size connections are in use.
+    '''
+
+    def __init__(self, connect, size):
+        assert size > 0
+        self.size = size
+        self._connect = connect
+        self._condition = threading.Condition()
+        self._idle = []
+        self._connections = set()
+        self._local = threading.local()
+        self.closed = False
+
+    def connection(self):
+        ''' Return the connection of the current thread '''
+        lease = getattr(self._local, 'lease', None)
+        if lease is None:
+            lease = self._local.lease = _Lease(self, self._acquire())
+        return lease.connection
+
+    def release(self):
+        ''' Return the connection of the current thread to the pool '''
+        lease = getattr(self._local, 'lease', None)
+        if lease is not None:
+            del self._local.lease
+            lease.release()
+
+    def close(self):
+        ''' Close all connections, including ones used by other threads '''
+        with self._condition:
+            self.closed = True
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+            self._idle = []
+            self._condition.notify_all()
+        self._local = threading.local()
+
+    def _acquire(self):
+        with self._condition:
+            while True:
+                if self.closed:
+                    raise sqlite3.ProgrammingError(
+                        'Cannot operate on a closed database.')
+                if self._idle:
+                    return self._idle.pop()
+                if len(self._connections) < self.size:
+                    connection = self._connect()
+                    self._connections.add(connection)
+                    return connection
+                self._condition.wait()
+
+    def _put_back(self, connection):
+        with self._condition:
+            if connection not in self._connections:
+                # pool was closed meanwhile
+                return
+            if connection.open_transactions:
+                # abandoned within a transaction - do not reuse
+                self._connections.remove(connection)
+                connection.close()
+            else:
+                self._idle.append(connection)
+            self._condition.notify()
+
+
+class _Lease(object):
+    '''
+    Thread local holder of a pooled connection.
+
+    Returns the connection to the pool when the thread ends.
+    '''
+
+    def __init__(self, pool, connection):
+        self.pool = pool
+        self.connection = connection
+
+    def release(self):
+        connection, self.connection = self.connection, None
+        if connection is not None:
+            self.pool._put_back(connection)
+
+    def __del__(self):
+        self.release()
+
+
+class UnitOfWork(object):
+    '''
+    Buffer of the create(), save() and delete() calls of a thread,
+    see Database.unit_of_work().
+
+    create() and save() capture the values to write.  flush() writes the
+    buffered changes in one transaction, in the order they were made:
+    each run of consecutive changes of the same kind and class is
+    written with one executemany (updates: per run of the same fields).
+    Repeated saves of an object are coalesced, when there is no other
+    change between them.
+    '''
+
+    def __init__(self, database):
+        self.database = database
+        # changes are buffered only outside of transactions started since
+        self.open_transactions = database.open_transactions
+        self._clear()
+
+    def _clear(self):
+        # [(kind, class, OrderedDict)], kind is 'create', 'save' or 'delete'
+        # entries are keyed by id(object):
+        # (object, fields, values) or for deletes (object, key)
+        self.batches = []
+        # id(object) -> fields written by its buffered changes
+        self.written = {}
+        # _key() -> buffered object, for the ids not deleted
+        self.objects = {}
+        self.deleted = set()
+
+    def __len__(self):
+        return sum(len(batch) for _, _, batch in self.batches)
+
+    def _key(self, object):
+        return object.__class__, _db_id(get_meta(object), object.id)
+
+    def _last_batch(self, kind, storable_class):
+        if self.batches:
+            last_kind, last_class, batch = self.batches[-1]
+            if last_kind == kind and last_class is storable_class:
+                return batch
+        return None
+
+    def _batch(self, kind, storable_class):
+        ''' Return the batch the next change of :kind is added to '''
+        batch = self._last_batch(kind, storable_class)
+        if batch is None:
+            batch = collections.OrderedDict()
+            self.batches.append((kind, storable_class, batch))
+        return batch
+
+    def _capture(self, meta, batch, object, fields):
+        object_id = id(object)
+        batch[object_id] = (
+            object, fields, [getattr(object, attr) for attr in fields])
+        written = self.written.get(object_id)
+        if written is None or not written.issuperset(fields):
+            self.written[object_id] = (written or frozenset()).union(fields)
+        if object.id is not None:
+            key = object.__class__, _db_id(meta, object.id)
+            if self.deleted:
+                self.deleted.discard(key)
+            self.objects[key] = object
+
+    def create(self, object):
+        if id(object) in self.written:
+            # already buffered
+            self.save(object)
+            return
+        meta = get_meta(object)
+        meta.primary_key.generate_id(object)
+        self._capture(
+            meta, self._batch('create', object.__class__), object,
+            meta.data_fields)
+
+    def save(self, object):
+        written = self.written.get(id(object))
+        if written is None and object.id is None:
+            self.create(object)
+            return
+        meta = get_meta(object)
+        storable_class = object.__class__
+        batch = self._last_batch('create', storable_class)
+        if batch is not None and id(object) in batch:
+            # not inserted yet, the insert takes the new values
+            self._capture(meta, batch, object, meta.data_fields)
+            return
+
+        if object.id is None:
+            # inserted by flush(), not read since
+            fields = meta.data_fields
+        else:
+            fields = changed_fields(object)
+            if written:
+                # the row is as read until flush(), so the fields
+                # written by the buffered changes are written again
+                fields = tuple(
+                    attr for attr in meta.data_fields
+                    if attr in written or attr in fields)
+        if fields:
+            self._capture(
+                meta, self._batch('save', storable_class), object, fields)
+
+    def delete(self, object):
+        ''' Buffer deleting :object, its id is kept '''
+        key = self._key(object)
+        self.objects.pop(key, None)
+        self.written.pop(id(object), None)
+        if key[1] is not None:
+            self.deleted.add(key)
+        batch = self._last_batch('create', object.__class__)
+        if batch is not None and id(object) in batch:
+            # inserted by the last change, thus never written
+            del batch[id(object)]
+            return
+        self._batch('delete', object.__class__)[id(object)] = object, key
+
+    def get(self, storable_class, db_id):
+        '''
+        Return the buffered object with :db_id, None if there is none.
+
+        raise LookupError if it is deleted.
+        '''
+        key = storable_class, db_id
+        if key in self.deleted:
+            raise LookupError(storable_class, db_id)
+        return self.objects.get(key)
+
+    def flush(self):
+        ''' Write the buffered changes to the database '''
+        if not self:
+            return
+        batches = self.batches
+        self._clear()
+
+        # id(object) -> db id, for objects inserted with generated ids
+        inserted = {}
+        with self.database.transaction():
+            for kind, storable_class, batch in batches:
+                if not batch:
+                    continue
+                if kind == 'delete':
+                    self._delete(storable_class, batch.values(), inserted)
+                    continue
+                meta = get_class_meta(storable_class)
+                for fields, entries in _runs_by_fields(batch.values()):
+                    objects = [object for object, _, _ in entries]
+                    with _captured_values(entries):
+                        if kind == 'create':
+                            _insert_many(storable_class, objects)
+                            for object in objects:
+                                inserted[id(object)] = _db_id(meta, object.id)
+                        else:
+                            _update_many(storable_class, objects, fields)
+
+    def _delete(self, storable_class, entries, inserted):
+        meta = get_class_meta(storable_class)
+        deleted = []
+        for object, key in entries:
+            if key[1] is None:
+                # was created by this unit, if at all
+                db_id = inserted.get(id(object))
+                if db_id is None:
+                    continue
+                key = storable_class, db_id
+                object.id = None
+            deleted.append((object, key))
+        if not deleted:
+            return
+
+        self.database.execute_many_sql(
+            meta.statements.delete, [[key[1]] for _, key in deleted],
+            'delete', meta.table_name)
+        object_cache = self.database.object_cache
+        for object, key in deleted:
+            _forget(object)
+            if object_cache is not None:
+                object_cache.evict(key)
+
+
+def _runs_by_fields(entries):
+    '''
+    Split (object, fields, values) :entries into runs with the same fields,
+    yield (fields, entries)
+    '''
+    run_fields, run = None, []
+    for entry in entries:
+        fields = entry[1]
+        if fields != run_fields:
+            if run:
+                yield run_fields, run
+            run_fields, run = fields, []
+        run.append(entry)
+    if run:
+        yield run_fields, run
+
+
+@contextlib.contextmanager
+def _captured_values(entries):
+    '''
+    Set the captured values on the objects of (object, fields, values)
+    :entries while writing them, then restore the current values.
+    '''
+    current = []
+    for object, fields, values in entries:
+        for attr, value in zip(fields, values):
+            object_value = getattr(object, attr)
+            if object_value is not value:
+                current.append((object, attr, object_value))
+                setattr(object, attr, value)
+    try:
+        yield
+    finally:
+        for object, attr, value in current:
+            setattr(object, attr, value)
 
 
 class Database(object):
 
-    connection = None
+    def __init__(
+            self, dbref=':memory:', cached_statements=CACHED_STATEMENTS,
+            object_cache_size=None, pool_size=None, profile=None):
+        '''
+        object_cache_size: when given, rows read or written through
+        this database are kept in an ObjectCache of that many entries
+
+        pool_size: when given, every thread uses its own connection,
+        from a ConnectionPool of at most that many connections
 
-    def __init__(self, dbref=':memory:'):
-        self.connection = None
-        self.open_transactions = 0
+        profile: settings applied to every new connection, either
+        the name of one of PROFILES or a dict of SETTINGS
+        '''
+        self.dbref = None
+        self.cached_statements = cached_statements
+        self.pool_size = pool_size
+        self.profile = get_profile(profile)
+        self._connection = None
+        self._pool = None
+        self.object_cache = None
+        if object_cache_size:
+            self.object_cache = ObjectCache(object_cache_size)
+        self.query_advisor = None
+        self.hooks = ()
+        self._units = threading.local()
+        # units of work open in any thread, to skip looking them up if 0
+        self._open_units = 0
+        self._open_units_lock = threading.Lock()
         if dbref:
             self.connect(dbref)
 
     def connect(self, dbref):
         '''
         in sqlite3 dbref is either ':memory:' or a filename
+
+        ':memory:' can not be shared between connections,
+        so it is not supported with a connection pool.
+        '''
+        if self.pool_size and dbref == ':memory:':
+            raise ValueError('in-memory database can not be pooled')
+
+        self.close()
+        self.dbref = dbref
+        self._pool = self._connection = None
+        if self.pool_size:
+            self._pool = ConnectionPool(self._open_connection, self.pool_size)
+        else:
+            self._connection = self._open_connection()
+        if self.object_cache is not None:
+            self.object_cache.clear()
+
+    def _open_connection(self):
+        connection = sqlite3.connect(
+            self.dbref,
+            cached_statements=self.cached_statements,
+            factory=Connection,
+            # pooled connections are used by one thread at a time,
+            # but not necessarily by the one that opened them
+            check_same_thread=not self.pool_size)
+        connection.isolation_level = AUTOCOMMIT
+        connection.execute('PRAGMA foreign_keys=ON')
+        for setting in SETTINGS:
+            if setting in self.profile:
+                connection.execute('PRAGMA {}={}'.format(
+                    setting, self.profile[setting])).fetchall()
+        return connection
+
+    @property
+    def connection(self):
+        ''' Connection of the current thread '''
+        if self._pool is not None:
+            return self._pool.connection()
+        return self._connection
+
+    @property
+    def open_transactions(self):
+        return self.connection.open_transactions
+
+    def release_connection(self):
+        '''
+        Give back the current thread's connection to the pool.
+
+        To be called by pooled threads that are done with the database.
         '''
-        self.connection = sqlite3.connect(dbref)
-        self.connection.isolation_level = AUTOCOMMIT
-        self.enable_foreign_keys()
+        if self._pool is not None:
+            assert not self.open_transactions
+            self._pool.release()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+        if self._connection is not None:
+            self._connection.close()
 
     # Administration
     def pragma_foreign_keys(self, extra=''):
@@ -76,18 +910,66 @@ class Database(object):
             'PRAGMA foreign_keys{}'.format(extra)
         ).fetchone()
 
+    def settings(self):
+        ''' Effective SETTINGS of the current connection '''
+        connection = self.connection
+        settings = {}
+        for setting in SETTINGS:
+            row = connection.execute('PRAGMA {}'.format(setting)).fetchone()
+            # not all settings apply to in-memory databases
+            settings[setting] = row[0] if row else None
+        settings['synchronous'] = SYNCHRONOUS[settings['synchronous']]
+        settings['temp_store'] = TEMP_STORE[settings['temp_store']]
+        return settings
+
+    def enable_query_advisor(self):
+        '''
+        Start explaining the queries of filter() and get().
+
+        See QueryAdvisor.report() for the results.
+        '''
+        if self.query_advisor is None:
+            self.query_advisor = QueryAdvisor()
+        return self.query_advisor
+
+    def disable_query_advisor(self):
+        self.query_advisor = None
+
+    def add_hook(self, hook):
+        '''
+        Call hook(QueryEvent) after each statement executed and
+        each transaction finished.
+
+        Hooks run on the executing thread, they should be fast.
+        See QueryStats and SlowQueryLog.
+        '''
+        self.hooks += (hook,)
+        return hook
+
+    def remove_hook(self, hook):
+        self.hooks = tuple(h for h in self.hooks if h != hook)
+
+    def _emit(self, event):
+        for hook in self.hooks:
+            hook(event)
+
     def enable_foreign_keys(self):
         self.pragma_foreign_keys(extra='=ON')
 
     def disable_foreign_keys(self):
         self.pragma_foreign_keys(extra='=OFF')
 
-    def get_cursor(self, sql, params):
+    def get_cursor(self, sql, params, operation='sql', table=None):
         '''
         with get_cursor('INSERT ... ?', ['1', ...]) as c:
             # work with cursor c
+
+        operation and table are reported to hooks, see QueryEvent.
         '''
         cursor = self.connection.cursor()
+        if self.hooks:
+            cursor = _InstrumentedCursor(
+                self, cursor, operation, table, sql, params)
         try:
             cursor.execute(sql, params)
             return contextlib.closing(cursor)
@@ -95,14 +977,96 @@ class Database(object):
             cursor.close()
             raise
 
-    def execute_sql(self, sql, params):
-        with self.get_cursor(sql, params):
+    def execute_sql(self, sql, params, operation='sql', table=None):
+        with self.get_cursor(sql, params, operation, table):
             pass
 
+    def execute_many_sql(
+            self, sql, seq_of_params, operation='sql', table=None):
+        '''
+        execute_many_sql('INSERT ... ?', [['1', ...], ['2', ...]])
+        '''
+        cursor = self.connection.cursor()
+        if self.hooks:
+            cursor = _InstrumentedCursor(
+                self, cursor, operation, table, sql, seq_of_params)
+        try:
+            cursor.executemany(sql, seq_of_params)
+        finally:
+            cursor.close()
+
+    def max_variable_number(self):
+        ''' Maximum number of bound parameters in a statement '''
+        getlimit = getattr(self.connection, 'getlimit', None)
+        if getlimit is None:
+            return MAX_VARIABLE_NUMBER
+        return getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+
+    def last_insert_rowid(self):
+        sql = 'SELECT last_insert_rowid()'
+        return self.connection.execute(sql).fetchone()[0]
+
+    # Unit of work
+    @contextlib.contextmanager
+    def unit_of_work(self):
+        '''
+        Buffer the create(), save() and delete() calls of this thread
+        on objects of this database, and write them on exit.
+
+        with db.unit_of_work() as unit:
+            ...
+            unit.flush()  # to write earlier, e.g. before filter()
+
+        Within the block get() sees the buffered changes,
+        queries see only the flushed ones.  On exception the buffered
+        changes are discarded.  Nested blocks join the outermost one.
+
+        A transaction() in the block flushes the buffer, and the changes
+        within it are written immediately, so that they can be rolled
+        back.  upsert(), update_where() and delete_where() also flush
+        the buffer before they run.
+        '''
+        unit = getattr(self._units, 'unit', None)
+        if unit is not None:
+            yield unit
+            return
+
+        unit = self._units.unit = UnitOfWork(self)
+        with self._open_units_lock:
+            self._open_units += 1
+        try:
+            yield unit
+            unit.flush()
+        finally:
+            with self._open_units_lock:
+                self._open_units -= 1
+            self._units.unit = None
+
+    def current_unit_of_work(self):
+        '''
+        UnitOfWork of the current thread, None if there is none,
+        or a transaction was started since.
+        '''
+        if not self._open_units:
+            return None
+        unit = getattr(self._units, 'unit', None)
+        if unit is None or self.open_transactions > unit.open_transactions:
+            return None
+        return unit
+
     # Transactions
+    def atransaction(self):
+        '''
+        async with db.atransaction():
+            # see omlite_async
+        '''
+        import omlite_async
+        return omlite_async.atransaction(self)
+
     @contextlib.contextmanager
     def transaction(self):
-        assert self.open_transactions >= 0
+        connection = self.connection
+        assert connection.open_transactions >= 0
 
         # transactions work only when the connection is in autocommit mode
         # https://pysqlite.readthedocs.org/en/latest/sqlite3.html#controlling-transactions
@@ -110,20 +1074,70 @@ class Database(object):
         # https://groups.google.com/forum/#!msg/sqlalchemy-devel/0lanNjxSpb0/6zriniGAfu0J
         # http://bugs.python.org/issue10740
         # http://rogerbinns.github.io/apsw/pysqlite.html#pysqlitediffs
-        assert self.connection.isolation_level is AUTOCOMMIT
-
-        execute = self.connection.execute
-        savepoint_name = 'omlite_{}'.format(self.open_transactions)
+        assert connection.isolation_level is AUTOCOMMIT
+
+        unit = self.current_unit_of_work()
+        if unit is not None:
+            # the buffered changes precede the ones in the transaction
+            unit.flush()
+
+        execute = connection.execute
+        object_cache = self.object_cache
+        savepoint_name = 'omlite_{}'.format(connection.open_transactions)
+        hooks = self.hooks
+        if hooks:
+            start = clock()
+            outcome = 'rollback'
         execute('SAVEPOINT {}'.format(savepoint_name))
+        if object_cache is not None:
+            object_cache.begin()
         try:
-            self.open_transactions += 1
+            connection.open_transactions += 1
             yield
             execute('RELEASE SAVEPOINT {}'.format(savepoint_name))
+            if hooks:
+                outcome = 'commit'
         except:
+            # ROLLBACK TO keeps the savepoint (and the outermost one
+            # keeps the transaction) open, hence the RELEASE
             execute('ROLLBACK TO SAVEPOINT {}'.format(savepoint_name))
+            execute('RELEASE SAVEPOINT {}'.format(savepoint_name))
             raise
         finally:
-            self.open_transactions -= 1
+            connection.open_transactions -= 1
+            if object_cache is not None:
+                object_cache.end()
+            if hooks:
+                self._emit(
+                    QueryEvent(outcome, None, None, None, clock() - start, 0))
+
+# values reported by PRAGMAs
+SYNCHRONOUS = ('off', 'normal', 'full', 'extra')
+TEMP_STORE = ('default', 'file', 'memory')
+
+
+def get_profile(profile):
+    '''
+    Validate and return the settings of :profile.
+
+    :profile is None, a name in PROFILES or a dict of SETTINGS
+    '''
+    if profile is None:
+        return {}
+    if not isinstance(profile, dict):
+        try:
+            profile = PROFILES[profile]
+        except KeyError:
+            raise ValueError('unknown profile {!r}'.format(profile))
+
+    for setting, value in profile.items():
+        if setting not in SETTINGS:
+            raise ValueError('unknown setting {!r}'.format(setting))
+        # values are formatted into PRAGMAs, so only plain words or numbers
+        if not (isinstance(value, int) or str(value).isalpha()):
+            raise ValueError(
+                'invalid value {!r} for {}'.format(value, setting))
+    return dict(profile)
 
 '''
 Single global instance - when only one database is needed
@@ -132,13 +1146,198 @@ db = Database()
 
 
 class Field(object):
+    '''
+    A database field of a storable class.
 
-    def __init__(self, sql_declaration=None):
+    Subclasses converting values define from_db(value) and to_db(value),
+    they are never called with None.
+    '''
+
+    from_db = None
+    to_db = None
+
+    def __init__(self, sql_declaration=None, index=False, deferred=False):
+        '''
+        index: create_table() also creates an index on the field,
+        a unique one if index is 'unique'
+
+        deferred: the field is not read with the object,
+        but on first access (unless fields= or defer= says otherwise)
+        '''
+        assert index in (False, True, 'unique')
         self.sql_declaration = sql_declaration
+        self.index = index
+        self.deferred = deferred
+        # set by get_db_fields()
+        self.name = None
+
+    def __get__(self, object, storable_class):
+        '''
+        Load the value of a deferred field on first access.
+
+        Called only when the attribute is not set on the object.
+        '''
+        if object is not None:
+            deferred = object.__dict__.get(DEFERRED_ATTR)
+            if deferred and self.name in deferred:
+                load_deferred([object], [self.name])
+                return object.__dict__[self.name]
+        return self
+
+
+class BlobField(Field):
+    '''
+    Binary field, which is deferred by default and can be streamed.
+
+    The value can be assigned a readable, seekable file object:
+    create() and save() stream it into the database.
+
+    See open_blob(), iter_blob(), write_blob() and blob_size().
+    '''
+
+    def __init__(self, sql_declaration='BLOB', index=False, deferred=True):
+        super(BlobField, self).__init__(sql_declaration, index, deferred)
+
+
+class DateTimeField(Field):
+    '''
+    datetime.datetime stored as ISO 8601 text, e.g. '2015-03-01 12:30:00'
+    '''
+
+    # for Python versions without datetime.fromisoformat()
+    FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d')
+
+    def __init__(self, sql_declaration='TIMESTAMP', **kwargs):
+        super(DateTimeField, self).__init__(sql_declaration, **kwargs)
+
+    def from_db(self, value):
+        fromisoformat = getattr(datetime.datetime, 'fromisoformat', None)
+        if fromisoformat is not None:
+            return fromisoformat(value)
+        for format in self.FORMATS:
+            try:
+                return datetime.datetime.strptime(value, format)
+            except ValueError:
+                pass
+        raise ValueError('not a datetime: {!r}'.format(value))
+
+    def to_db(self, value):
+        if not isinstance(value, datetime.datetime):
+            raise TypeError('{}: datetime expected, got {!r}'.format(
+                self.name, value))
+        return value.isoformat(' ')
+
+
+class DecimalField(Field):
+    '''
+    decimal.Decimal stored as text, so that no precision is lost
+    '''
+
+    def __init__(self, sql_declaration='TEXT', **kwargs):
+        super(DecimalField, self).__init__(sql_declaration, **kwargs)
+
+    def from_db(self, value):
+        return decimal.Decimal(value)
+
+    def to_db(self, value):
+        return str(decimal.Decimal(value))
+
+
+class JSONField(Field):
+    '''
+    JSON serializable value stored as JSON text
+    '''
+
+    def __init__(self, sql_declaration='TEXT', **kwargs):
+        super(JSONField, self).__init__(sql_declaration, **kwargs)
+
+    def from_db(self, value):
+        return json.loads(value)
+
+    def to_db(self, value):
+        # sorted keys keep the text, thus dirty tracking stable
+        return json.dumps(value, sort_keys=True)
+
+
+class BoolField(Field):
+    '''
+    bool stored as 0 or 1
+    '''
+
+    def __init__(self, sql_declaration='BOOLEAN', **kwargs):
+        super(BoolField, self).__init__(sql_declaration, **kwargs)
+
+    def from_db(self, value):
+        return bool(value)
+
+    def to_db(self, value):
+        return int(bool(value))
+
+
+class EnumField(Field):
+    '''
+    Member of :enum_class stored as its value
+    '''
+
+    def __init__(self, enum_class, sql_declaration=None, **kwargs):
+        super(EnumField, self).__init__(sql_declaration, **kwargs)
+        self.enum_class = enum_class
+
+    def from_db(self, value):
+        return self.enum_class(value)
+
+    def to_db(self, value):
+        # raises ValueError for values not in the enum
+        return self.enum_class(value).value
+
+
+class SQLIndex(object):
+    '''
+    Index on :columns of a table.
+
+    :columns is SQL: a column name, or comma separated column names
+    or expressions.
+    :where makes a partial index.
+    The default name is made of the table, the columns and a hash of
+    :where, two indexes of a class can not have the same name.
+    '''
+
+    def __init__(self, columns, unique=False, where=None, name=None):
+        self.columns = columns
+        self.unique = unique
+        self.where = where
+        self.name = name
+
+    def get_name(self, table_name):
+        if self.name:
+            return self.name
+        columns = re.sub(r'\W+', '_', self.columns).strip('_')
+        if self.where:
+            where = binascii.crc32(self.where.encode('utf-8')) & 0xffffffff
+            columns += '_where_{:08x}'.format(where)
+        return '{}_{}_idx'.format(table_name, columns)
+
+    def _definition(self):
+        return self.columns, bool(self.unique), self.where
+
+    def get_sql(self, table_name):
+        sql = 'CREATE {unique}INDEX IF NOT EXISTS {name} ON {table}({columns})'
+        sql = sql.format(
+            unique='UNIQUE ' if self.unique else '',
+            name=self.get_name(table_name),
+            table=table_name,
+            columns=self.columns)
+        if self.where:
+            sql += ' WHERE {}'.format(self.where)
+        return sql
 
 
 class PrimaryKey(Field):
 
+    def new_id(self):
+        ''' New id to be stored, None if the database generates it '''
+        return None
+
     def generate_id(self, object):
         pass
 
@@ -146,6 +1345,29 @@ class PrimaryKey(Field):
         if object.id is None:
             object.id = cursor.lastrowid
 
+    def save_generated_ids(self, meta, objects):
+        '''
+        Assign ids to :objects just inserted with NULL id by one executemany.
+
+        Within a transaction sqlite gives each NULL id row max(rowid) + 1,
+        so the batch occupies the consecutive range ending at the last rowid.
+        '''
+        database = meta.database
+        last_id = database.last_insert_rowid()
+        first_id = last_id - len(objects) + 1
+
+        sql = meta.statements.count_id_range
+        params = [first_id, last_id]
+        with database.get_cursor(
+                sql, params, 'create', meta.table_name) as cursor:
+            count, = cursor.fetchone()
+        if count != len(objects):
+            # the caller's transaction is rolled back
+            raise IntegrityError('generated ids are not consecutive')
+
+        for id, object in enumerate(objects, first_id):
+            object.id = id
+
 
 class AutoincrementPrimaryKey(PrimaryKey):
 
@@ -159,9 +1381,76 @@ class UUIDPrimaryKey(PrimaryKey):
         super(UUIDPrimaryKey, self).__init__('VARCHAR PRIMARY KEY')
         self.uuid_generator = uuid_generator
 
+    def new_id(self):
+        return str(self.uuid_generator())
+
     def generate_id(self, object):
         if object.id is None:
-            object.id = str(self.uuid_generator())
+            object.id = self.new_id()
+
+
+class BinaryUUIDPrimaryKey(UUIDPrimaryKey):
+    '''
+    UUID stored as a 16 byte BLOB instead of 36 characters of text.
+
+    Objects still have str ids, and ids can be given as str or uuid.UUID.
+    In SQL predicates the id is a BLOB, parameters should be converted
+    with to_db().
+    '''
+
+    def __init__(self, uuid_generator):
+        super(BinaryUUIDPrimaryKey, self).__init__(uuid_generator)
+        self.sql_declaration = 'BLOB PRIMARY KEY'
+
+    # conversions avoid uuid.UUID for the canonical format, as it is slow
+
+    def from_db(self, value):
+        hex = binascii.hexlify(value).decode('ascii')
+        return '-'.join(
+            (hex[:8], hex[8:12], hex[12:16], hex[16:20], hex[20:]))
+
+    def to_db(self, value):
+        if isinstance(value, uuid.UUID):
+            return BLOB(value.bytes)
+        if len(value) == 36 and value.count('-') == 4:
+            try:
+                return BLOB(binascii.unhexlify(value.replace('-', '')))
+            except (TypeError, ValueError):
+                pass
+        return BLOB(uuid.UUID(value).bytes)
+
+
+_uuid7_lock = threading.Lock()
+_uuid7_last = [0, 0]
+_uuid7_random = random.SystemRandom()
+
+
+def uuid7():
+    '''
+    Time ordered UUID (version 7 of RFC 9562).
+
+    The first 48 bits are the unix time in milliseconds, followed by
+    a 12 bit counter randomly started in every millisecond,
+    so ids generated by a process are increasing.
+    New rows are appended to the primary key index, instead of
+    landing at random pages as with uuid4.
+    '''
+    with _uuid7_lock:
+        last_ms, counter = _uuid7_last
+        ms = int(time.time() * 1000)
+        if ms > last_ms:
+            # leave room for counting up in the same millisecond
+            counter = _uuid7_random.getrandbits(11)
+        else:
+            ms = last_ms
+            counter += 1
+            if counter > 0xfff:
+                ms += 1
+                counter = 0
+        _uuid7_last[:] = ms, counter
+    random_bits = _uuid7_random.getrandbits(62)
+    return uuid.UUID(int=(
+        ms << 80 | 0x7 << 76 | counter << 64 | 0x2 << 62 | random_bits))
 
 
 def get_db_fields(cls):
@@ -170,31 +1459,335 @@ def get_db_fields(cls):
     for attr in dir(cls):
         field = getattr(cls, attr)
         if isinstance(field, Field):
+            field.name = attr
             fields[attr] = field
 
     assert isinstance(fields[PK_FIELD], PrimaryKey)
     return fields
 
 
+class SQLStatements(object):
+    '''
+    SQL statements of a storable class, built once.
+    '''
+
+    # distinct predicates remembered for select_where()
+    MAX_PREDICATES = 128
+
+    def __init__(self, meta):
+        table = self._table = meta.table_name
+        fields = meta.ordered_fields
+
+        self.insert = 'INSERT INTO {table}({fields}) VALUES ({values})'.format(
+            table=table,
+            fields=', '.join(fields),
+            values=', '.join(['?'] * len(fields)))
+        self.delete = 'DELETE FROM {table} WHERE id=?'.format(table=table)
+        self.select_by_id = 'SELECT * FROM {table} WHERE id=? LIMIT 1'.format(
+            table=table)
+        self.select_fields = 'SELECT {fields} FROM {table}'.format(
+            table=table, fields=', '.join(fields))
+        self.select_rowid = 'SELECT rowid FROM {table} WHERE id=?'.format(
+            table=table)
+        self.rowid_range = 'SELECT min(rowid), max(rowid) FROM {}'.format(
+            table)
+        self.count_id_range = (
+            'SELECT count(*) FROM {table} WHERE id BETWEEN ? AND ?'.format(
+                table=table))
+
+        self._select_prefix = 'SELECT * FROM {table} WHERE '.format(
+            table=table)
+        self._select_where = {}
+        self._select_by_ids = {}
+        self._update_prefix = 'UPDATE {table} SET '.format(table=table)
+        self._update_fields = {}
+        self._upsert_fields = {}
+        self.delete_where_prefix = 'DELETE FROM {table} WHERE '.format(
+            table=table)
+
+    def select_where(self, sql_predicate, columns=None):
+        '''
+        SELECT statement reading :columns (default: all) of matching rows
+        '''
+        key = str(sql_predicate), columns
+        try:
+            return self._select_where[key]
+        except KeyError:
+            if len(self._select_where) >= self.MAX_PREDICATES:
+                self._select_where.clear()
+            if columns is None:
+                sql = self._select_prefix + key[0]
+            else:
+                sql = 'SELECT {columns} FROM {table} WHERE {predicate}'.format(
+                    columns=', '.join(columns),
+                    table=self._table,
+                    predicate=key[0])
+            self._select_where[key] = sql
+            return sql
+
+    def select_by_ids(self, count, columns=None):
+        key = count, columns
+        try:
+            return self._select_by_ids[key]
+        except KeyError:
+            sql = self.select_where(
+                'id IN ({})'.format(', '.join(['?'] * count)), columns)
+            self._select_by_ids[key] = sql
+            return sql
+
+    def update(self, fields):
+        ''' UPDATE statement setting :fields, a tuple of field names '''
+        try:
+            return self._update_fields[fields]
+        except KeyError:
+            if len(self._update_fields) >= self.MAX_PREDICATES:
+                self._update_fields.clear()
+            set_fields = ', '.join('{} = ?'.format(attr) for attr in fields)
+            sql = self._update_prefix + set_fields + ' WHERE id=?'
+            self._update_fields[fields] = sql
+            return sql
+
+    def upsert(self, fields):
+        '''
+        INSERT statement updating :fields, a tuple of field names,
+        when the id already exists
+        '''
+        try:
+            return self._upsert_fields[fields]
+        except KeyError:
+            if len(self._upsert_fields) >= self.MAX_PREDICATES:
+                self._upsert_fields.clear()
+            if fields:
+                on_conflict = 'DO UPDATE SET ' + ', '.join(
+                    '{0} = excluded.{0}'.format(attr) for attr in fields)
+            else:
+                on_conflict = 'DO NOTHING'
+            sql = '{} ON CONFLICT(id) {}'.format(self.insert, on_conflict)
+            self._upsert_fields[fields] = sql
+            return sql
+
+    def update_where(self, fields, sql_predicate):
+        set_fields = ', '.join('{} = ?'.format(attr) for attr in fields)
+        return '{}{} WHERE {}'.format(
+            self._update_prefix, set_fields, sql_predicate)
+
+
 class StorableMeta(object):
 
     def __init__(self, storable_class):
         self.fields = get_db_fields(storable_class)
         self.ordered_fields = tuple(sorted(self.fields))
+        self.data_fields = tuple(
+            attr for attr in self.ordered_fields if attr != PK_FIELD)
+        self.deferred_fields = frozenset(
+            attr for attr, field in self.fields.items() if field.deferred)
+        # converters of the fields that have them
+        self.from_db = dict(
+            (attr, field.from_db) for attr, field in self.fields.items()
+            if field.from_db is not None)
+        self.to_db = dict(
+            (attr, field.to_db) for attr, field in self.fields.items()
+            if field.to_db is not None)
+        self.id_to_db = self.to_db.get(PK_FIELD)
         self.primary_key = self.fields[PK_FIELD]
+        self._statements = None
         self.database = db
         self.table_name = '{}s'.format(storable_class.__name__.lower())
         self.constraints = []
+        self.indexes = [
+            SQLIndex(attr, unique=field.index == 'unique')
+            for attr, field in sorted(self.fields.items())
+            if field.index]
+        self.construct_with_init = False
+        self.compact = False
+        self._loaders = {}
+        self._row_types = {}
+
+    @property
+    def database(self):
+        return self._database
+
+    @database.setter
+    def database(self, database):
+        self._database = database
+        self.invalidate_statements()
+
+    @property
+    def table_name(self):
+        return self._table_name
+
+    @table_name.setter
+    def table_name(self, table_name):
+        self._table_name = table_name
+        self.invalidate_statements()
+
+    @property
+    def statements(self):
+        ''' SQLStatements for the current table name '''
+        if self._statements is None:
+            self._statements = SQLStatements(self)
+        return self._statements
+
+    def invalidate_statements(self):
+        self._statements = None
 
     def initialize_fields(self, object):
         ''' initialize all uninitialized database fields to None'''
+        deferred = _get_deferred(object)
         for attr, field in self.fields.items():
-            if getattr(object, attr) is field:
+            # unset slots of compact objects have no value at all
+            if attr not in deferred and getattr(object, attr, field) is field:
                 setattr(object, attr, None)
 
     def add_constraint(self, constraint):
         self.constraints.append(constraint)
 
+    def add_index(self, index):
+        name = index.get_name(self.table_name)
+        for other in self.indexes:
+            if other.get_name(self.table_name) == name:
+                if other._definition() == index._definition():
+                    return
+                raise ValueError(
+                    'index {} is already defined differently'.format(name))
+        self.indexes.append(index)
+
+    def get_row_type(self, storable_class, columns):
+        ''' Return a namedtuple class for rows with :columns '''
+        try:
+            return self._row_types[columns]
+        except KeyError:
+            row_type = self._row_types[columns] = collections.namedtuple(
+                storable_class.__name__ + 'Row', columns)
+            return row_type
+
+    def read_plan(self, columns):
+        '''
+        Return ((index, from_db), ...) converting a row with :columns
+        '''
+        return tuple(
+            (i, self.from_db[attr]) for i, attr in enumerate(columns)
+            if attr in self.from_db)
+
+    def db_values(self, fields, values):
+        ''' Convert :values of :fields to be written to the database '''
+        if not self.to_db:
+            return values
+        to_db = self.to_db
+        return [
+            value if value is None or attr not in to_db
+            else to_db[attr](value)
+            for attr, value in zip(fields, values)]
+
+    def get_loader(self, storable_class, columns, deferred=frozenset()):
+        '''
+        Return a function making a :storable_class instance from a row
+        with :columns.
+
+        :deferred fields are left unset, to be loaded on first access.
+        '''
+        key = storable_class, columns, deferred
+        try:
+            return self._loaders[key]
+        except KeyError:
+            loader = self._loaders[key] = self._make_loader(*key)
+            return loader
+
+    def _make_loader(self, storable_class, columns, deferred):
+        for attr in columns:
+            assert attr in self.fields, attr
+        # the snapshot keeps the unconverted row, as it is in the database
+        plan = self.read_plan(columns)
+
+        if self.construct_with_init:
+            def load(row):
+                obj = storable_class()
+                if deferred:
+                    obj_dict = obj.__dict__
+                    for attr in deferred:
+                        obj_dict.pop(attr, None)
+                    obj_dict[DEFERRED_ATTR] = deferred
+                values = _convert_row(plan, row) if plan else row
+                for attr, value in zip(columns, values):
+                    setattr(obj, attr, value)
+                self.initialize_fields(obj)
+                setattr(obj, LOADED_ROW_ATTR, (columns, row))
+                return obj
+            return load
+
+        if self.compact:
+            return self._make_compact_loader(storable_class, columns, plan)
+
+        # fields not read from the database are initialized to None
+        defaults = dict.fromkeys(set(self.fields) - set(columns) - deferred)
+        if deferred:
+            defaults[DEFERRED_ATTR] = deferred
+        new = storable_class.__new__
+
+        if not plan:
+            def load(row):
+                obj = new(storable_class)
+                obj_dict = obj.__dict__
+                obj_dict.update(defaults)
+                obj_dict.update(zip(columns, row))
+                obj_dict[LOADED_ROW_ATTR] = columns, row
+                return obj
+            return load
+
+        def load_converted(row):
+            obj = new(storable_class)
+            obj_dict = obj.__dict__
+            obj_dict.update(defaults)
+            obj_dict.update(zip(columns, _convert_row(plan, row)))
+            obj_dict[LOADED_ROW_ATTR] = columns, row
+            return obj
+        return load_converted
+
+    def _make_compact_loader(self, storable_class, columns, plan):
+        # there is no __dict__, slots are set by their descriptors
+        def setter(attr):
+            return getattr(storable_class, attr).__set__
+        setters = tuple(setter(attr) for attr in columns)
+        defaults = tuple(
+            setter(attr) for attr in self.fields if attr not in columns)
+        set_loaded = setter(LOADED_ROW_ATTR)
+        new = storable_class.__new__
+
+        def load(row):
+            obj = new(storable_class)
+            for set_default in defaults:
+                set_default(obj, None)
+            values = _convert_row(plan, row) if plan else row
+            for set_value, value in zip(setters, values):
+                set_value(obj, value)
+            set_loaded(obj, (columns, row))
+            return obj
+        return load
+
+    def get_projection(self, fields=None, defer=None):
+        '''
+        Return (columns to read, deferred fields) for reading only :fields
+        or all fields except :defer.
+        '''
+        if self.compact and (fields is not None or defer is not None):
+            raise ValueError('compact objects are always read whole')
+        if fields is None and defer is None:
+            if not self.deferred_fields:
+                return None, frozenset()
+            defer = self.deferred_fields
+        assert fields is None or defer is None, 'both fields and defer given'
+        if fields is not None:
+            selected = set(fields) | set([PK_FIELD])
+        else:
+            selected = set(self.fields) - set(defer)
+            assert PK_FIELD in selected, 'id can not be deferred'
+        for attr in selected:
+            if attr not in self.fields:
+                raise ValueError('unknown field {!r}'.format(attr))
+        columns = tuple(attr for attr in self.ordered_fields
+                        if attr in selected)
+        return columns, frozenset(self.fields) - selected
+
 
 # Class decorators
 def database(database):
@@ -229,6 +1822,63 @@ def table_name(table_name):
     return decorate
 
 
+def construct_with_init(storable_class):
+    ''' Make objects read from the database with calling __init__
+
+    By default __init__ is bypassed when reading objects from the
+    database, which is faster, but wrong if __init__ has side effects
+    or sets up non-database attributes that the object relies on.
+
+    @construct_with_init
+    @storable
+    class Data(object):
+        ...
+    '''
+    meta = get_class_meta(storable_class)
+    assert meta is not None
+    meta.construct_with_init = True
+    meta._loaders.clear()
+    return storable_class
+
+
+def compact(storable_class):
+    ''' Make a storable class with __slots__ instead of per object __dict__
+
+    Objects without a __dict__ are smaller: with 5 fields an object
+    takes 88 bytes instead of 176 (object + __dict__) on CPython 3.11,
+    and 104 bytes instead of 1112 on Python 2.7.  In exchange:
+    - only the database fields can be set on the objects,
+    - fields can not be deferred, objects are always read whole,
+    - methods can not use the argument-less super(),
+    - all base classes should have __slots__ too,
+      otherwise TypeError is raised.
+
+    @compact
+    @storable
+    class Data(object):
+        ...
+    '''
+    meta = copy.copy(get_class_meta(storable_class))
+    meta.constraints = list(meta.constraints)
+    meta.indexes = list(meta.indexes)
+    meta.compact = True
+    meta.deferred_fields = frozenset()
+    meta._loaders = {}
+
+    namespace = dict(vars(storable_class))
+    for attr in list(meta.fields) + ['__dict__', '__weakref__']:
+        namespace.pop(attr, None)
+    namespace['__slots__'] = meta.ordered_fields + (LOADED_ROW_ATTR,)
+    namespace[STORABLE_META_ATTR] = meta
+    compact_class = type(storable_class)(
+        storable_class.__name__, storable_class.__bases__, namespace)
+    if compact_class.__dictoffset__:
+        raise TypeError(
+            'base classes of {} have no __slots__'.format(
+                storable_class.__name__))
+    return compact_class
+
+
 def sql_constraint(contstraint):
     ''' Add a table constraint to a storable class definition
 
@@ -243,6 +1893,25 @@ def sql_constraint(contstraint):
     return decorate
 
 
+def sql_index(columns, unique=False, where=None, name=None):
+    ''' Add an index to a storable class definition
+
+    @sql_index('last_name, first_name')
+    @sql_index('email', unique=True, where='deleted IS NULL')
+    @storable
+    class Data(object):
+        ...
+
+    Indexes are created by create_table() and ensure_indexes().
+    '''
+    def decorate(storable_class):
+        meta = get_class_meta(storable_class)
+        assert meta is not None
+        meta.add_index(SQLIndex(columns, unique, where, name))
+        return storable_class
+    return decorate
+
+
 def get_storable(cls, id):
     setattr(cls, PK_FIELD, id)
     assert PK_FIELD in dir(cls)
@@ -283,6 +1952,18 @@ storable_pk_random_uuid4 = functools.partial(
     get_storable,
     id=UUIDPrimaryKey(uuid.uuid4))
 
+storable_pk_uuid7 = functools.partial(
+    get_storable,
+    id=UUIDPrimaryKey(uuid7))
+
+storable_pk_binary_uuid4 = functools.partial(
+    get_storable,
+    id=BinaryUUIDPrimaryKey(uuid.uuid4))
+
+storable_pk_binary_uuid7 = functools.partial(
+    get_storable,
+    id=BinaryUUIDPrimaryKey(uuid7))
+
 
 # Internals
 def get_class_meta(storable_class):
@@ -293,41 +1974,592 @@ def get_meta(object):
     return get_class_meta(object.__class__)
 
 
-def read_row(storable_class, cursor):
+def read_rows(
+        storable_class, cursor, cache_generation=None, deferred=frozenset()):
+    ''' I am streaming objects from the rows of a cursor.
+
+    Rows are added to the object cache, if the cache was not changed since
+    :cache_generation - which should be taken before executing the query.
+    Rows with :deferred fields are never cached.
+    '''
     meta = get_class_meta(storable_class)
+    columns = tuple(col[0] for col in cursor.description)
+    load = meta.get_loader(storable_class, columns, deferred)
+    object_cache = None if deferred else meta.database.object_cache
+    if cache_generation is None and object_cache is not None:
+        cache_generation = object_cache.generation
+
+    fetchmany = cursor.fetchmany
+    while True:
+        rows = fetchmany(FETCH_BATCH_SIZE)
+        if not rows:
+            return
+        if object_cache is not None:
+            _cache_rows(
+                object_cache, storable_class, columns, rows, cache_generation)
+        for row in rows:
+            yield load(row)
+
+
+def _cache_rows(object_cache, storable_class, columns, rows, generation):
+    id_index = columns.index(PK_FIELD)
+    for row in rows:
+        object_cache.fill(
+            (storable_class, row[id_index]), columns, tuple(row), generation)
+
+
+def _stored(meta, object):
+    '''
+    Record that :object was written to the database.
+    '''
+    deferred = _get_deferred(object)
+    if deferred:
+        # deferred fields assigned since were written as well
+        object_dict = object.__dict__
+        deferred = deferred.difference(object_dict)
+        if deferred:
+            object_dict[DEFERRED_ATTR] = deferred
+        else:
+            del object_dict[DEFERRED_ATTR]
+        columns = tuple(
+            attr for attr in meta.ordered_fields if attr not in deferred)
+    else:
+        columns = meta.ordered_fields
+    row = tuple(meta.db_values(
+        columns, [getattr(object, attr) for attr in columns]))
+    setattr(object, LOADED_ROW_ATTR, (columns, row))
+
+    object_cache = meta.database.object_cache
+    if object_cache is not None:
+        key = object.__class__, _db_id(meta, object.id)
+        if deferred:
+            object_cache.evict(key)
+        else:
+            object_cache.put(key, columns, row)
+
+
+def _removed(meta, object):
+    '''
+    Record that :object is no longer in the database.
+    '''
+    _forget(object)
+    object_cache = meta.database.object_cache
+    if object_cache is not None:
+        object_cache.evict((object.__class__, _db_id(meta, object.id)))
+
+
+def _forget(object):
+    ''' Forget the row :object was read from or written to '''
+    if hasattr(object, LOADED_ROW_ATTR):
+        delattr(object, LOADED_ROW_ATTR)
+
+
+def _db_id(meta, id):
+    ''' :id as stored in the database, also the object cache key '''
+    to_db = meta.id_to_db
+    if to_db is None or id is None:
+        return id
+    return to_db(id)
+
+
+def _row(meta, object):
+    ''' Values of :object as written to the database '''
+    fields = meta.ordered_fields
+    return tuple(
+        meta.db_values(fields, [getattr(object, attr) for attr in fields]))
 
-    row = next(cursor)
-    obj = storable_class()
-    for idx, col in enumerate(cursor.description):
-        dbattr = col[0]
-        assert dbattr in meta.fields
-        # TODO: convert/validate value as specified by Field
-        setattr(obj, dbattr, row[idx])
 
-    meta.initialize_fields(obj)
-    return obj
+def _convert_row(plan, row):
+    ''' Apply read_plan() to :row, NULLs are not converted '''
+    values = list(row)
+    for i, from_db in plan:
+        value = values[i]
+        if value is not None:
+            values[i] = from_db(value)
+    return values
+
+
+def _get_deferred(object):
+    return getattr(object, DEFERRED_ATTR, NOTHING_DEFERRED)
+
+
+NOTHING_DEFERRED = frozenset()
+
+
+def _pop_projection(meta, options):
+    ''' Return (columns, deferred) for fields= and defer= :options '''
+    fields = options.pop('fields', None)
+    defer = options.pop('defer', None)
+    if options:
+        raise TypeError(
+            'unexpected keyword arguments: {}'.format(', '.join(options)))
+    return meta.get_projection(fields, defer)
 
 
 # CRUD / Object Mapper
-def get(storable_class, id):
+def get(storable_class, id, fields=None, defer=None):
     ''' I retrieve an object from database by its :id.
 
+    Only :fields are read, or all fields except :defer, if either is given.
+    The rest are read on first access - see also load_deferred().
+
     raise LookupError if no row was found.
     '''
-    return list(filter(storable_class, 'id=?', id))[0]
-
+    meta = get_class_meta(storable_class)
+    columns, deferred = meta.get_projection(fields, defer)
+    db_id = _db_id(meta, id)
+
+    unit = meta.database.current_unit_of_work()
+    if unit is not None:
+        object = unit.get(storable_class, db_id)
+        if object is not None:
+            return object
+
+    object_cache = meta.database.object_cache
+    if object_cache is not None:
+        entry = object_cache.get((storable_class, db_id))
+        if entry is not None:
+            columns, row = entry
+            return meta.get_loader(storable_class, columns)(row)
+        cache_generation = object_cache.generation
+        if deferred:
+            object_cache = None
+
+    if columns is None:
+        sql = meta.statements.select_by_id
+    else:
+        sql = meta.statements.select_where('id=? LIMIT 1', columns)
+    query_advisor = meta.database.query_advisor
+    if query_advisor is not None:
+        query_advisor.observe(meta.database, meta, 'id=?', sql, [db_id])
+    with meta.database.get_cursor(
+            sql, [db_id], 'get', meta.table_name) as cursor:
+        row = cursor.fetchone()
+        if row is None:
+            raise LookupError(storable_class, id)
+        columns = tuple(col[0] for col in cursor.description)
+
+    if object_cache is not None:
+        _cache_rows(
+            object_cache, storable_class, columns, [row], cache_generation)
+    return meta.get_loader(storable_class, columns, deferred)(row)
+
+
+def get_many(storable_class, ids, fields=None, defer=None):
+    ''' I retrieve objects from database by their :ids.
+
+    Objects are returned in the order of :ids, fetched with as few
+    queries as the sqlite limit on bound parameters allows.
+    :fields and :defer are as for get().
+
+    raise LookupError with the list of missing ids if not all were found.
+    '''
+    meta = get_class_meta(storable_class)
+    columns, deferred = meta.get_projection(fields, defer)
+    ids = list(ids)
+    db_ids = [_db_id(meta, id) for id in ids]
+    objects = {}
+
+    object_cache = meta.database.object_cache
+    if object_cache is not None:
+        for id in db_ids:
+            entry = object_cache.get((storable_class, id))
+            if entry is not None:
+                cached_columns, row = entry
+                objects[id] = meta.get_loader(
+                    storable_class, cached_columns)(row)
+
+    unique_ids = list(collections.OrderedDict.fromkeys(
+        id for id in db_ids if id not in objects))
+    for chunk in _id_chunks(unique_ids, meta.database.max_variable_number()):
+        sql = meta.statements.select_by_ids(len(chunk), columns)
+        for obj in _select(storable_class, sql, chunk, deferred, 'get'):
+            objects[_db_id(meta, obj.id)] = obj
+
+    missing = [
+        id for id, db_id in zip(ids, db_ids) if db_id not in objects]
+    if missing:
+        raise LookupError(storable_class, missing)
+    return [objects[id] for id in db_ids]
+
+
+def _id_chunks(ids, max_chunk_size):
+    '''
+    Split :ids into chunks of a few distinct sizes.
 
-def filter(storable_class, sql_predicate, *params):
+    Chunks are padded by repeating their last id up to the next power of
+    two, so that only a handful of statements are ever prepared.
+    '''
+    chunk_size = 1
+    while chunk_size < len(ids) and chunk_size * 2 <= max_chunk_size:
+        chunk_size *= 2
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        padded_size = 1
+        while padded_size < len(chunk):
+            padded_size *= 2
+        yield chunk + chunk[-1:] * (padded_size - len(chunk))
+
+
+def filter(storable_class, sql_predicate, *params, **options):
     ''' I am streaming objects from database that match the predicate.
+
+    options:
+    - fields: read only these fields (and id)
+    - defer: read all fields except these
+    Fields not read are loaded on first access - see also load_deferred().
     '''
     meta = get_class_meta(storable_class)
+    columns, deferred = _pop_projection(meta, options)
+    sql = meta.statements.select_where(sql_predicate, columns)
+    return _select(
+        storable_class, sql, params, deferred, sql_predicate=sql_predicate)
+
+
+def _select(
+        storable_class, sql, params, deferred=frozenset(),
+        operation='filter', sql_predicate=None):
+    '''
+    Stream the objects read by :sql.
 
-    sql = 'SELECT * FROM {table} WHERE {predicate}'.format(
-        table=meta.table_name, predicate=sql_predicate)
+    :sql_predicate is shown to the query advisor, on first iteration,
+    so on the thread that reads the rows.
+    '''
+    meta = get_class_meta(storable_class)
+    if sql_predicate is not None:
+        query_advisor = meta.database.query_advisor
+        if query_advisor is not None:
+            query_advisor.observe(
+                meta.database, meta, sql_predicate, sql, params)
+    object_cache = meta.database.object_cache
+    cache_generation = None
+    if object_cache is not None:
+        cache_generation = object_cache.generation
+    with meta.database.get_cursor(
+            sql, params, operation, meta.table_name) as cursor:
+        objects = read_rows(storable_class, cursor, cache_generation, deferred)
+        for obj in objects:
+            yield obj
+
+
+def load_deferred(objects, fields=None):
+    ''' I read deferred fields of :objects with as few queries as possible.
+
+    Only :fields are read if given, otherwise all deferred fields.
+    '''
+    objects_by_class = collections.OrderedDict()
+    for object in objects:
+        if _get_deferred(object):
+            objects_by_class.setdefault(object.__class__, []).append(object)
 
-    with meta.database.get_cursor(sql, params) as cursor:
+    for storable_class, objects in objects_by_class.items():
+        meta = get_class_meta(storable_class)
+        deferred = set()
+        for object in objects:
+            deferred.update(_get_deferred(object))
+        if fields is not None:
+            deferred.intersection_update(fields)
+        if not deferred:
+            continue
+        columns = (PK_FIELD,) + tuple(sorted(deferred))
+
+        objects_by_id = collections.defaultdict(list)
+        for object in objects:
+            objects_by_id[_db_id(meta, object.id)].append(object)
+        ids = list(objects_by_id)
+        max_chunk_size = meta.database.max_variable_number()
+        for chunk in _id_chunks(ids, max_chunk_size):
+            sql = meta.statements.select_by_ids(len(chunk), columns)
+            with meta.database.get_cursor(
+                    sql, chunk, 'get', meta.table_name) as cursor:
+                for row in cursor:
+                    for object in objects_by_id.pop(row[0], ()):
+                        _set_deferred(object, columns[1:], row[1:])
+
+        if objects_by_id:
+            raise LookupError(storable_class, list(objects_by_id))
+
+
+def _set_deferred(object, columns, row):
+    ''' Set the values of deferred fields '''
+    deferred = _get_deferred(object)
+    from_db = get_meta(object).from_db
+    loaded_columns, loaded_row = getattr(object, LOADED_ROW_ATTR)
+    object_dict = object.__dict__
+    for attr, value in zip(columns, row):
+        if attr in deferred:
+            loaded_columns += (attr,)
+            loaded_row += (value,)
+            if attr in object_dict:
+                # assigned before being read, the assigned value is kept
+                continue
+            if value is not None and attr in from_db:
+                value = from_db[attr](value)
+            object_dict[attr] = value
+    deferred = deferred.difference(columns)
+    if deferred:
+        object_dict[DEFERRED_ATTR] = deferred
+    else:
+        del object_dict[DEFERRED_ATTR]
+    setattr(object, LOADED_ROW_ATTR, (loaded_columns, tuple(loaded_row)))
+
+
+class Page(collections.namedtuple('Page', 'objects after')):
+    '''
+    A page of objects from iter_pages().
+
+    after: token to pass to iter_pages(after=...) to continue after this page
+    '''
+    __slots__ = ()
+
+
+def iter_pages(storable_class, sql_predicate, *params, **options):
+    ''' I am streaming pages of objects matching the predicate in key order.
+
+    Pages are read by keyset pagination (WHERE key > ? ORDER BY key LIMIT ?),
+    so no cursor - and no read transaction - is kept open between pages
+    and each page costs the same, however deep the scan is.
+
+    options:
+    - page_size: max number of objects in a page (default: PAGE_SIZE)
+    - after: resume after the page with this Page.after token
+    - key: order by this NOT NULL field (then id), default is id
+    - fields, defer: see filter()
+    '''
+    meta = get_class_meta(storable_class)
+    page_size = options.pop('page_size', PAGE_SIZE)
+    after = options.pop('after', None)
+    key = options.pop('key', PK_FIELD)
+    columns, deferred = _pop_projection(meta, options)
+    assert page_size > 0
+    if key not in meta.fields:
+        raise ValueError('unknown field {!r}'.format(key))
+    if columns is not None and key not in columns:
+        columns += (key,)
+        deferred = deferred - frozenset([key])
+
+    if key == PK_FIELD:
+        order_by = PK_FIELD
+        after_key = '{} > ?'.format(PK_FIELD)
+    else:
+        order_by = '{}, {}'.format(key, PK_FIELD)
+        after_key = '({key} > ? OR ({key} = ? AND {pk} > ?))'.format(
+            key=key, pk=PK_FIELD)
+    first_page_predicate = '({}) ORDER BY {} LIMIT ?'.format(
+        sql_predicate, order_by)
+    next_page_predicate = '({}) AND {} ORDER BY {} LIMIT ?'.format(
+        sql_predicate, after_key, order_by)
+
+    while True:
+        if after is None:
+            predicate = first_page_predicate
+            page_params = params + (page_size,)
+        elif key == PK_FIELD:
+            predicate = next_page_predicate
+            page_params = params + (_db_id(meta, after), page_size)
+        else:
+            predicate = next_page_predicate
+            after_key_value, after_id = after
+            after_id = _db_id(meta, after_id)
+            page_params = params + (
+                after_key_value, after_key_value, after_id, page_size)
+
+        sql = meta.statements.select_where(predicate, columns)
+        objects = list(_select(
+            storable_class, sql, page_params, deferred,
+            sql_predicate=predicate))
+        if not objects:
+            return
+
+        last = objects[-1]
+        if key == PK_FIELD:
+            after = last.id
+        else:
+            after_key_value, = meta.db_values([key], [getattr(last, key)])
+            after = after_key_value, last.id
+        yield Page(objects, after)
+        if len(objects) < page_size:
+            return
+
+
+def _query_rows(storable_class, sql_predicate, params, fields):
+    ''' Return (columns, get_cursor() context) for filter_rows() '''
+    meta = get_class_meta(storable_class)
+    if fields is None:
+        columns = meta.ordered_fields
+    else:
+        columns = tuple(fields)
+        for attr in columns:
+            if attr not in meta.fields:
+                raise ValueError('unknown field {!r}'.format(attr))
+    sql = meta.statements.select_where(sql_predicate, columns)
+    query_advisor = meta.database.query_advisor
+    if query_advisor is not None:
+        query_advisor.observe(
+            meta.database, meta, sql_predicate, sql, params)
+    cursor = meta.database.get_cursor(
+        sql, params, 'filter', meta.table_name)
+    return columns, cursor
+
+
+def filter_rows(storable_class, sql_predicate, *params, **options):
+    ''' I am streaming the matching rows as tuples, without making objects.
+
+    Values are as stored in the database, Field converters are not applied.
+
+    options:
+    - fields: the fields in the tuples, in this order (default: all)
+    - named: yield namedtuples instead of plain tuples
+    '''
+    fields = options.pop('fields', None)
+    named = options.pop('named', False)
+    if options:
+        raise TypeError(
+            'unexpected keyword arguments: {}'.format(', '.join(options)))
+    columns, query = _query_rows(
+        storable_class, sql_predicate, params, fields)
+    make_row = None
+    if named:
+        meta = get_class_meta(storable_class)
+        make_row = meta.get_row_type(storable_class, columns)._make
+
+    with query as cursor:
+        while True:
+            rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+            if not rows:
+                return
+            if make_row is not None:
+                rows = map(make_row, rows)
+            for row in rows:
+                yield row
+
+
+def filter_columns(storable_class, sql_predicate, *params, **options):
+    ''' I read the matching rows column by column, without making objects.
+
+    Values are as stored in the database, Field converters are not applied.
+
+    Return an OrderedDict {field: column}, a column is an array.array
+    if its typecode is given, otherwise a list.
+
+    options:
+    - fields: the fields to read, in this order (default: all)
+    - typecodes: {field: array.array typecode}, e.g. {'price': 'd'}
+      (the column must not contain NULL then)
+    - numpy: return NumPy arrays instead (needs numpy installed)
+    '''
+    fields = options.pop('fields', None)
+    typecodes = options.pop('typecodes', {})
+    as_numpy = options.pop('numpy', False)
+    if options:
+        raise TypeError(
+            'unexpected keyword arguments: {}'.format(', '.join(options)))
+    if as_numpy:
+        import numpy
+
+    columns, query = _query_rows(
+        storable_class, sql_predicate, params, fields)
+    for attr in typecodes:
+        if attr not in columns:
+            raise ValueError('typecode for unread field {!r}'.format(attr))
+    result = collections.OrderedDict(
+        (attr, array.array(typecodes[attr]) if attr in typecodes else [])
+        for attr in columns)
+    extenders = [column.extend for column in result.values()]
+
+    with query as cursor:
         while True:
-            yield read_row(storable_class, cursor)
+            rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+            if not rows:
+                break
+            for extend, values in zip(extenders, zip(*rows)):
+                extend(values)
+
+    if as_numpy:
+        for attr, column in result.items():
+            # arrays are wrapped without copy
+            result[attr] = numpy.asarray(column)
+    return result
+
+
+def parallel_map(storable_class, function, sql_predicate, *params, **options):
+    ''' I am streaming function(object) for the matching objects,
+    computed in worker processes.
+
+    The table is split into rowid ranges, every worker process reads its
+    ranges through its own read-only connection to the database file.
+    :function and its results are pickled, so :function must be
+    importable (a module level function) and cheap results pay off best.
+    Workers see only committed data.
+
+    options:
+    - workers: number of processes (default: number of CPUs)
+    - ordered: stream results in rowid order (default: True),
+      otherwise in the order ranges are finished
+    - batch: call function(objects) with the list of objects of each
+      range instead, streaming one result per range - e.g. partial
+      aggregates to be combined by the caller
+    - fields, defer: see filter()
+    '''
+    meta = get_class_meta(storable_class)
+    workers = options.pop('workers', None) or multiprocessing.cpu_count()
+    ordered = options.pop('ordered', True)
+    batch = options.pop('batch', False)
+    # validate the rest in this process
+    meta.get_projection(options.get('fields'), options.get('defer'))
+    dbref = meta.database.dbref
+    if not dbref or dbref == ':memory:':
+        raise ValueError('in-memory database can not be read by workers')
+
+    with meta.database.get_cursor(
+            meta.statements.rowid_range, (),
+            'filter', meta.table_name) as cursor:
+        first, last = cursor.fetchone()
+    if first is None:
+        return
+
+    predicate = 'rowid >= ? AND rowid < ? AND ({})'.format(sql_predicate)
+    step = -(-(last + 1 - first) // (workers * RANGES_PER_WORKER))
+    tasks = [
+        (storable_class, function, batch, predicate,
+         (start, start + step) + params, options)
+        for start in range(first, last + 1, step)]
+
+    pool = multiprocessing.Pool(
+        min(workers, len(tasks)), _parallel_worker_init,
+        (storable_class, dbref))
+    try:
+        map_ = pool.imap if ordered else pool.imap_unordered
+        for results in map_(_parallel_worker_map, tasks):
+            for result in results:
+                yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# connections inherited by forked workers, see _parallel_worker_init()
+_inherited_connections = []
+
+
+def _parallel_worker_init(storable_class, dbref):
+    ''' Connect the database of :storable_class read-only in a worker '''
+    database = get_class_meta(storable_class).database
+    # A forked worker has a copy of the parent's connection, closing it
+    # could roll back a transaction of the parent, so it is kept open.
+    _inherited_connections.append((database._connection, database._pool))
+    database._connection = database._pool = None
+    database.connect(dbref)
+    database.connection.execute('PRAGMA query_only=ON')
+
+
+def _parallel_worker_map(task):
+    storable_class, function, batch, predicate, params, options = task
+    objects = filter(storable_class, predicate, *params, **options)
+    if batch:
+        return [function(list(objects))]
+    return [function(object) for object in objects]
 
 
 def get_all(storable_class):
@@ -344,10 +2576,15 @@ def save(object):
     An object is treated as new, if its :id is None.
     If the object's id is not None, the matching row is updated.
     '''
-    if object.id is None:
+    unit = get_meta(object).database.current_unit_of_work()
+    if unit is not None:
+        unit.save(object)
+    elif object.id is None:
         create(object)
     else:
-        _update(object)
+        fields = changed_fields(object)
+        if fields:
+            _update(object, fields)
 
 
 def create(object):
@@ -360,38 +2597,278 @@ def create(object):
       - object is inserted into database with the given id
     '''
     meta = get_meta(object)
+    unit = meta.database.current_unit_of_work()
+    if unit is not None:
+        unit.create(object)
+        return
 
     meta.primary_key.generate_id(object)
 
-    sql = 'INSERT INTO {table}({fields}) VALUES ({values})'.format(
-        table=meta.table_name,
-        fields=', '.join(meta.ordered_fields),
-        values=', '.join(['?'] * len(meta.ordered_fields)))
+    sql = meta.statements.insert
+    row = _row(meta, object)
+    streams = _get_streams(meta, meta.ordered_fields, row)
+    if streams:
+        row = [None if attr in streams else value
+               for attr, value in zip(meta.ordered_fields, row)]
+        with meta.database.transaction():
+            with meta.database.get_cursor(
+                    sql, row, 'create', meta.table_name) as cursor:
+                meta.primary_key.save_generated_id(cursor, object)
+            _write_streams(object, streams)
+    else:
+        with meta.database.get_cursor(
+                sql, row, 'create', meta.table_name) as cursor:
+            meta.primary_key.save_generated_id(cursor, object)
+    _stored(meta, object)
+
+
+def create_many(objects):
+    ''' I create many new objects in the database.
+
+    Objects are grouped by class and inserted with one executemany
+    per class, in a single transaction per database.
+
+    Ids are assigned as with create():
+    - pre-filled ids are kept
+    - generated UUIDs are assigned before inserting
+    - autoincrement ids are assigned after inserting
+    '''
+    for database, objects_by_class in _by_database(objects):
+        unit = database.current_unit_of_work()
+        if unit is not None:
+            for _, objects in objects_by_class:
+                for object in objects:
+                    unit.create(object)
+            continue
+        with database.transaction():
+            for storable_class, objects in objects_by_class:
+                _insert_many(storable_class, objects)
+
+
+def _by_database(objects):
+    '''
+    Group :objects by database and within that by class,
+    in order of first appearance.
+
+    Return [(database, [(class, objects)])].
+    '''
+    objects_by_class = collections.OrderedDict()
+    for object in objects:
+        objects_by_class.setdefault(object.__class__, []).append(object)
 
-    values = [getattr(object, attr) for attr in meta.ordered_fields]
-    with meta.database.get_cursor(sql, values) as cursor:
-        meta.primary_key.save_generated_id(cursor, object)
+    classes_by_database = collections.OrderedDict()
+    for storable_class, objects in objects_by_class.items():
+        database = get_class_meta(storable_class).database
+        classes_by_database.setdefault(database, []).append(
+            (storable_class, objects))
+    return list(classes_by_database.items())
 
 
-def _update(object):
+def upsert(object, fields=None):
+    ''' I insert :object, or update its row if its id is already taken.
+
+    Only :fields are updated in an existing row (default: all).
+
+    Needs sqlite 3.24+.
+    '''
+    upsert_many([object], fields)
+
+
+def upsert_many(objects, fields=None):
+    ''' I upsert many objects with one executemany per class.
+
+    Objects without id are created.  All objects of a database are
+    upserted in one transaction.  See upsert().
+    '''
+    for database, objects_by_class in _by_database(objects):
+        with database.transaction():
+            for storable_class, objects in objects_by_class:
+                _upsert_many(storable_class, objects, fields)
+
+
+def _upsert_many(storable_class, objects, fields):
+    meta = get_class_meta(storable_class)
+    if fields is None:
+        fields = meta.data_fields
+    else:
+        for attr in fields:
+            if attr not in meta.fields:
+                raise ValueError('unknown field {!r}'.format(attr))
+        fields = tuple(attr for attr in meta.data_fields if attr in fields)
+
+    for object in objects:
+        meta.primary_key.generate_id(object)
+    new = [object for object in objects if object.id is None]
+    if new:
+        _insert_many(storable_class, new)
+    objects = [object for object in objects if object.id is not None]
+    if not objects:
+        return
+
+    rows = [_row(meta, object) for object in objects]
+    for row in rows:
+        if _get_streams(meta, meta.ordered_fields, row):
+            raise ValueError('streams can not be upserted, use save()')
+    meta.database.execute_many_sql(
+        meta.statements.upsert(fields), rows, 'upsert', meta.table_name)
+
+    all_fields = len(fields) == len(meta.data_fields)
+    for object in objects:
+        if all_fields:
+            _stored(meta, object)
+        else:
+            # an existing row may differ from object in the other fields,
+            # so the row is forgotten
+            _removed(meta, object)
+
+
+def _insert_many(storable_class, objects):
+    meta = get_class_meta(storable_class)
+
+    for object in objects:
+        meta.primary_key.generate_id(object)
+
+    sql = meta.statements.insert
+
+    streams = {}
+
+    def rows(objects):
+        rows = []
+        for object in objects:
+            row = _row(meta, object)
+            object_streams = _get_streams(meta, meta.ordered_fields, row)
+            if object_streams:
+                streams[id(object)] = object_streams
+                row = [None if attr in object_streams else value
+                       for attr, value in zip(meta.ordered_fields, row)]
+            rows.append(row)
+        return rows
+
+    # rows with explicit ids go first, so that generated ids follow them
+    with_id = [object for object in objects if object.id is not None]
+    without_id = [object for object in objects if object.id is None]
+
+    if with_id:
+        meta.database.execute_many_sql(
+            sql, rows(with_id), 'create', meta.table_name)
+    if without_id:
+        meta.database.execute_many_sql(
+            sql, rows(without_id), 'create', meta.table_name)
+        meta.primary_key.save_generated_ids(meta, without_id)
+
+    for object in objects:
+        if id(object) in streams:
+            _write_streams(object, streams[id(object)])
+        _stored(meta, object)
+
+
+def _update(object, fields=None):
+    ''' I update :fields (default: all) of object in the database.
+    '''
     meta = get_meta(object)
-    set_fields = ['{} = ?'.format(attr) for attr in meta.ordered_fields]
-    values = [getattr(object, attr) for attr in meta.ordered_fields]
+    if fields is None:
+        fields = meta.data_fields
+    values = [getattr(object, attr) for attr in fields]
+    streams = _get_streams(meta, fields, values)
+    if streams:
+        with meta.database.transaction():
+            fields = [attr for attr in fields if attr not in streams]
+            _write_streams(object, streams)
+            if fields:
+                _update(object, fields)
+        return
+
+    values = list(meta.db_values(fields, values))
+    values.append(_db_id(meta, object.id))
+    sql = meta.statements.update(tuple(fields))
+    with meta.database.get_cursor(
+            sql, values, 'update', meta.table_name) as cursor:
+        updated = cursor.rowcount
+    if updated:
+        _stored(meta, object)
+    else:
+        _removed(meta, object)
 
-    sql = 'UPDATE {table} SET {set_fields} WHERE id=?'.format(
-        table=meta.table_name,
-        set_fields=', '.join(set_fields))
 
-    meta.database.execute_sql(sql, values + [object.id])
+def _update_many(storable_class, objects, fields):
+    ''' I update the same :fields of :objects with one executemany. '''
+    meta = get_class_meta(storable_class)
+    rows = []
+    for object in objects:
+        values = [getattr(object, attr) for attr in fields]
+        if _get_streams(meta, fields, values):
+            _update(object, fields)
+            continue
+        row = list(meta.db_values(fields, values))
+        row.append(_db_id(meta, object.id))
+        rows.append((object, row))
+    if not rows:
+        return
+
+    meta.database.execute_many_sql(
+        meta.statements.update(fields), [row for _, row in rows],
+        'update', meta.table_name)
+    for object, _ in rows:
+        _stored(meta, object)
+
+
+def is_dirty(object):
+    ''' I tell whether save() would write :object to the database.
+    '''
+    return bool(changed_fields(object))
+
+
+def changed_fields(object):
+    ''' I list the fields of :object changed since it was last read or saved.
+
+    All fields are changed for objects not read from the database.
+    '''
+    meta = get_meta(object)
+    if object.id is None:
+        return meta.ordered_fields
+
+    loaded = getattr(object, LOADED_ROW_ATTR, None)
+    if loaded is None:
+        return meta.data_fields
+
+    columns, row = loaded
+    loaded_values = dict(zip(columns, row))
+    deferred = _get_deferred(object)
+    to_db = meta.to_db
+    changed = []
+    for attr in meta.data_fields:
+        if attr in deferred:
+            if attr in object.__dict__:
+                # assigned without being read
+                changed.append(attr)
+            # otherwise not read, thus not changed
+            continue
+        value = getattr(object, attr)
+        if value is not None and attr in to_db:
+            # the snapshot has database values
+            value = to_db[attr](value)
+        if attr in loaded_values:
+            if value != loaded_values[attr]:
+                changed.append(attr)
+        elif value is not None:
+            # not a column of the read row, but set since
+            changed.append(attr)
+    return tuple(changed)
 
 
 def delete_but_keep_id(object):
     ''' I delete object from database.
     '''
     meta = get_meta(object)
+    unit = meta.database.current_unit_of_work()
+    if unit is not None:
+        unit.delete(object)
+        return
 
-    sql = 'DELETE FROM {table} WHERE id=?'.format(table=meta.table_name)
-    meta.database.execute_sql(sql, [object.id])
+    meta.database.execute_sql(
+        meta.statements.delete, [_db_id(meta, object.id)],
+        'delete', meta.table_name)
+    _removed(meta, object)
 
 
 def delete(object):
@@ -403,6 +2880,383 @@ def delete(object):
     object.id = None
 
 
+# BLOB streaming
+def _get_streams(meta, fields, values):
+    ''' Return {field: file object} for values to be streamed '''
+    return dict(
+        (attr, value) for attr, value in zip(fields, values)
+        if isinstance(meta.fields[attr], BlobField) and hasattr(value, 'read'))
+
+
+def _write_streams(object, streams):
+    for attr, fileobj in sorted(streams.items()):
+        write_blob(object, attr, fileobj)
+
+
+def _stream_size(fileobj):
+    position = fileobj.tell()
+    fileobj.seek(0, 2)
+    size = fileobj.tell() - position
+    fileobj.seek(position)
+    return size
+
+
+def _defer(object, attr):
+    ''' Forget the value of :attr, so it is read again on next access '''
+    object_dict = object.__dict__
+    object_dict.pop(attr, None)
+    object_dict[DEFERRED_ATTR] = _get_deferred(object) | frozenset([attr])
+    loaded = getattr(object, LOADED_ROW_ATTR, None)
+    if loaded is not None:
+        columns, row = loaded
+        loaded = tuple(zip(*[
+            (column, value) for column, value in zip(columns, row)
+            if column != attr]))
+        setattr(object, LOADED_ROW_ATTR, loaded or ((), ()))
+
+
+def _blob_field(object, attr):
+    meta = get_meta(object)
+    if attr not in meta.fields:
+        raise ValueError('unknown field {!r}'.format(attr))
+    return meta
+
+
+def open_blob(object, attr, readonly=True):
+    ''' I open field :attr of the stored :object for incremental I/O.
+
+    Return an sqlite3.Blob, a file like object, that also supports
+    len() and indexing/slicing.  The blob can not change size.
+
+    Needs Python 3.11+.
+    '''
+    meta = _blob_field(object, attr)
+    connection = meta.database.connection
+    blobopen = getattr(connection, 'blobopen', None)
+    if blobopen is None:
+        raise NotImplementedError('incremental BLOB I/O needs Python 3.11+')
+
+    with meta.database.get_cursor(
+            meta.statements.select_rowid, [_db_id(meta, object.id)],
+            'blob', meta.table_name) as cursor:
+        row = cursor.fetchone()
+    if row is None:
+        raise LookupError(object.__class__, object.id)
+    return blobopen(meta.table_name, attr, row[0], readonly=readonly)
+
+
+def blob_size(object, attr):
+    ''' I tell the length of field :attr of the stored :object in bytes.
+    '''
+    meta = _blob_field(object, attr)
+    sql = 'SELECT length({}) FROM {} WHERE id=?'.format(attr, meta.table_name)
+    params = [_db_id(meta, object.id)]
+    with meta.database.get_cursor(
+            sql, params, 'blob', meta.table_name) as cursor:
+        row = cursor.fetchone()
+    if row is None:
+        raise LookupError(object.__class__, object.id)
+    return row[0]
+
+
+def iter_blob(object, attr, chunk_size=BLOB_CHUNK_SIZE):
+    ''' I am streaming field :attr of the stored :object as memoryviews.
+
+    At most :chunk_size bytes are in memory at once.
+    '''
+    meta = _blob_field(object, attr)
+    if hasattr(meta.database.connection, 'blobopen'):
+        # NULL can not be opened
+        if not blob_size(object, attr):
+            return
+        with contextlib.closing(open_blob(object, attr)) as blob:
+            while True:
+                chunk = blob.read(chunk_size)
+                if not chunk:
+                    return
+                yield memoryview(chunk)
+
+    # without incremental BLOB I/O read by substr() queries
+    sql = 'SELECT substr({}, ?, ?) FROM {} WHERE id=?'.format(
+        attr, meta.table_name)
+    offset = 1
+    while True:
+        with meta.database.get_cursor(
+                sql, [offset, chunk_size, _db_id(meta, object.id)],
+                'blob', meta.table_name) as cursor:
+            row = cursor.fetchone()
+        if row is None:
+            raise LookupError(object.__class__, object.id)
+        if not row[0]:
+            return
+        yield memoryview(row[0])
+        offset += chunk_size
+
+
+def write_blob(object, attr, fileobj, size=None):
+    ''' I stream :fileobj into field :attr of the stored :object.
+
+    :size bytes are copied, by default all from the current position.
+    At most BLOB_CHUNK_SIZE bytes are in memory at once.
+
+    The field becomes deferred on :object, so it is not held in memory.
+
+    Needs Python 3.11+.
+    '''
+    meta = _blob_field(object, attr)
+    if meta.compact:
+        raise TypeError('compact objects can not defer fields')
+    if size is None:
+        size = _stream_size(fileobj)
+    database = meta.database
+
+    sql = 'UPDATE {} SET {} = zeroblob(?) WHERE id=?'.format(
+        meta.table_name, attr)
+    with database.transaction():
+        with database.get_cursor(
+                sql, [size, _db_id(meta, object.id)],
+                'blob', meta.table_name) as cursor:
+            if not cursor.rowcount:
+                raise LookupError(object.__class__, object.id)
+        with contextlib.closing(
+                open_blob(object, attr, readonly=False)) as blob:
+            remaining = size
+            while remaining:
+                chunk = fileobj.read(min(remaining, BLOB_CHUNK_SIZE))
+                if not chunk:
+                    raise ValueError('stream ended before {} bytes'.format(
+                        size))
+                blob.write(chunk)
+                remaining -= len(chunk)
+
+    _defer(object, attr)
+    object_cache = database.object_cache
+    if object_cache is not None:
+        object_cache.evict((object.__class__, _db_id(meta, object.id)))
+
+
+def update_where(storable_class, assignments, sql_predicate, *params):
+    ''' I set fields of all rows matching the predicate with one statement.
+
+    :assignments is a dict of field names to new values, ids can not
+    be changed.
+
+    Objects are not read, already read objects are not changed.
+    Return the number of updated rows.
+    '''
+    meta = get_class_meta(storable_class)
+    fields = tuple(sorted(assignments))
+    for attr in fields:
+        if attr == PK_FIELD:
+            raise ValueError('{} can not be updated'.format(PK_FIELD))
+        if attr not in meta.fields:
+            raise ValueError('unknown field {!r}'.format(attr))
+
+    sql = meta.statements.update_where(fields, sql_predicate)
+    values = list(meta.db_values(
+        fields, [assignments[attr] for attr in fields]))
+    values.extend(params)
+    return _execute_on_table(meta, sql, values, 'update')
+
+
+def delete_where(storable_class, sql_predicate, *params):
+    ''' I delete all rows matching the predicate with one statement.
+
+    Objects are not read, already read objects are not changed.
+    Return the number of deleted rows.
+    '''
+    meta = get_class_meta(storable_class)
+    sql = meta.statements.delete_where_prefix + str(sql_predicate)
+    return _execute_on_table(meta, sql, params, 'delete')
+
+
+def _execute_on_table(meta, sql, params, operation):
+    unit = meta.database.current_unit_of_work()
+    if unit is not None:
+        unit.flush()
+    with meta.database.get_cursor(
+            sql, params, operation, meta.table_name) as cursor:
+        rowcount = cursor.rowcount
+
+    object_cache = meta.database.object_cache
+    if object_cache is not None:
+        object_cache.evict_table(meta.table_name)
+    return rowcount
+
+
+# Bulk export / import
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+
+def _check_format(format):
+    if format not in EXPORT_FORMATS:
+        raise ValueError(
+            'unknown format {!r}, expected one of {}'.format(
+                format, ', '.join(EXPORT_FORMATS)))
+# rows read or written at once by export_rows() and import_rows()
+BULK_BATCH_SIZE = 1000
+
+
+class _Progress(object):
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.rows = 0
+        self.start = clock()
+
+    def add(self, rows):
+        self.rows += rows
+        if self.callback is not None:
+            elapsed = clock() - self.start
+            rate = self.rows / elapsed if elapsed else float(self.rows)
+            self.callback(self.rows, elapsed, rate)
+
+
+def export_rows(storable_class, fileobj, format='csv', progress=None):
+    ''' I write all rows of the class' table to :fileobj.
+
+    format:
+    - 'csv': a header line with the field names, then a line per row,
+      NULL is written as empty string
+    - 'jsonl': a JSON object per line
+
+    Columns are written in the order of meta.ordered_fields.
+    Ids are written as objects have them (binary UUIDs as str),
+    other BLOB values are not supported by these text formats.
+
+    :progress is called after every batch of rows with
+    (rows written, elapsed seconds, rows per second).
+
+    Return the number of rows written.
+    '''
+    _check_format(format)
+    meta = get_class_meta(storable_class)
+    fields = meta.ordered_fields
+    if format == 'csv':
+        writer = csv.writer(fileobj)
+        writer.writerow(fields)
+        write_rows = writer.writerows
+    else:
+        def write_rows(rows):
+            fileobj.writelines(
+                json.dumps(dict(zip(fields, row))) + '\n' for row in rows)
+
+    id_index = fields.index(PK_FIELD)
+    id_from_db = meta.from_db.get(PK_FIELD)
+
+    report = _Progress(progress)
+    sql = meta.statements.select_fields
+    with meta.database.get_cursor(sql, [], 'export', meta.table_name) as c:
+        while True:
+            rows = c.fetchmany(BULK_BATCH_SIZE)
+            if not rows:
+                break
+            if id_from_db is not None:
+                rows = [
+                    row[:id_index] + (id_from_db(row[id_index]),)
+                    + row[id_index + 1:]
+                    for row in rows]
+            write_rows(rows)
+            report.add(len(rows))
+    return report.rows
+
+
+def import_rows(
+        storable_class, fileobj, format='csv',
+        commit_interval=100 * BULK_BATCH_SIZE, progress=None):
+    ''' I insert rows read from :fileobj - as written by export_rows().
+
+    Rows are inserted by executemany in batches, and committed every
+    :commit_interval rows, so memory use is bounded.
+    Within an outer transaction, commits only release savepoints.
+
+    Missing fields are NULL.  Missing ids are generated as for new objects.
+
+    csv has only text, so a csv copy is not exact: the empty string
+    becomes NULL, and values in fields declared without type (like
+    Field()) become numbers if written as one - see _csv_value().
+    Fields declared with a type are converted by sqlite by the type's
+    affinity.  Use jsonl for an exact copy.
+
+    :progress is called after every batch of rows with
+    (rows inserted, elapsed seconds, rows per second).
+
+    Return the number of rows inserted.
+    '''
+    _check_format(format)
+    if commit_interval <= 0:
+        raise ValueError(
+            'commit_interval must be positive, got {!r}'.format(
+                commit_interval))
+    meta = get_class_meta(storable_class)
+    if format == 'csv':
+        reader = csv.reader(fileobj)
+        header = next(reader)
+        # columns without type affinity keep text as is in sqlite
+        untyped = [
+            attr in meta.fields and not meta.fields[attr].sql_declaration
+            for attr in header]
+        records = (
+            dict(zip(header, (
+                _csv_value(value) if convert else value or None
+                for convert, value in zip(untyped, row))))
+            for row in reader)
+    else:
+        records = (json.loads(line) for line in fileobj if line.strip())
+
+    fields = meta.ordered_fields
+    id_index = fields.index(PK_FIELD)
+    primary_key = meta.primary_key
+
+    def make_row(record):
+        for attr in record:
+            if attr not in meta.fields:
+                raise ValueError('unknown field {!r}'.format(attr))
+        row = [record.get(attr) for attr in fields]
+        id = row[id_index]
+        if id is None:
+            id = primary_key.new_id()
+        row[id_index] = _db_id(meta, id)
+        return row
+
+    batch_size = min(BULK_BATCH_SIZE, commit_interval)
+    batches_per_commit = commit_interval // batch_size
+    rows = (make_row(record) for record in records)
+    database = meta.database
+    sql = meta.statements.insert
+    report = _Progress(progress)
+    while True:
+        inserted = report.rows
+        with database.transaction():
+            for _ in range(batches_per_commit):
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+                database.execute_many_sql(
+                    sql, batch, 'create', meta.table_name)
+                report.add(len(batch))
+        if report.rows == inserted or len(batch) < batch_size:
+            return report.rows
+
+
+def _csv_value(text):
+    '''
+    :text as written by csv: the empty string is None, the canonical
+    text of an int or float is that number, anything else is text.
+    '''
+    if not text:
+        return None
+    if text[0] in '-0123456789':
+        for number_type in (int, float):
+            try:
+                number = number_type(text)
+            except ValueError:
+                continue
+            if repr(number) == text or str(number) == text:
+                return number
+    return text
+
+
 # Database structure
 def table_exists(storable_class):
     meta = get_class_meta(storable_class)
@@ -432,4 +3286,15 @@ def create_table(storable_class):
         table_name=meta.table_name,
         field_definitions=field_sep.join(field_definitions + meta.constraints),
     )
-    meta.database.connection.execute(sql)
+    with meta.database.transaction():
+        meta.database.connection.execute(sql)
+        ensure_indexes(storable_class)
+
+
+def ensure_indexes(storable_class):
+    ''' Create the declared indexes of the class missing from the database.
+    '''
+    meta = get_class_meta(storable_class)
+    with meta.database.transaction():
+        for index in meta.indexes:
+            meta.database.connection.execute(index.get_sql(meta.table_name))
@@ -0,0 +1,205 @@
+'''
+asyncio front-end for omlite
+
+All database work of a Database runs on a single dedicated thread,
+that owns its sqlite connection(s), so the event loop is never blocked
+on disk I/O.
+
+    await aconnect(db, 'data.sqlite')
+
+    a = await aget(A, 1)
+    async for a in afilter(A, 'a > ?', 3):
+        ...
+    async with db.atransaction():
+        await asave(a)
+
+A Database connected outside of its thread can still be used from
+here if it is pooled (see Database(pool_size=...)), as then the
+dedicated thread opens its own connection.
+
+While a task has a transaction open on a database, operations of
+other tasks on that database wait until it is finished, so they do not
+silently become part of it.  Tasks created within the transaction
+are part of it.
+
+Python 3 only.
+'''
+
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import itertools
+import weakref
+
+import omlite
+
+
+__all__ = (
+    'aconnect', 'aget', 'aget_many', 'afilter', 'aget_all',
+    'asave', 'acreate', 'acreate_many', 'adelete',
+    'atransaction', 'run_in_executor',
+)
+
+
+# number of objects moved from the database thread to the event loop at once
+BATCH_SIZE = omlite.FETCH_BATCH_SIZE
+
+_executors = weakref.WeakKeyDictionary()
+# database -> {event loop -> asyncio.Lock held by the task in a transaction}
+_transaction_locks = weakref.WeakKeyDictionary()
+# databases with a transaction open in the current task (or its parent)
+_open_transactions = contextvars.ContextVar(
+    'omlite_open_transactions', default=frozenset())
+
+
+def get_executor(database):
+    ''' Return the single thread executor dedicated to :database '''
+    try:
+        return _executors[database]
+    except KeyError:
+        executor = _executors[database] = (
+            concurrent.futures.ThreadPoolExecutor(max_workers=1))
+        return executor
+
+
+def run_in_executor(database, function, *args, **kwargs):
+    ''' Run function(*args, **kwargs) on the thread of :database '''
+    return asyncio.wrap_future(
+        get_executor(database).submit(function, *args, **kwargs))
+
+
+def _transaction_lock(database):
+    locks = _transaction_locks.setdefault(
+        database, weakref.WeakKeyDictionary())
+    loop = asyncio.get_running_loop()
+    try:
+        return locks[loop]
+    except KeyError:
+        lock = locks[loop] = asyncio.Lock()
+        return lock
+
+
+async def _run_in_turn(database, function, *args):
+    '''
+    Run function(*args) on the thread of :database,
+    after the transaction of an other task is finished.
+    '''
+    if database not in _open_transactions.get():
+        lock = _transaction_lock(database)
+        if lock.locked():
+            # no task can take the lock before function is submitted
+            async with lock:
+                pass
+    return await run_in_executor(database, function, *args)
+
+
+def _run_for_class(storable_class, function, *args):
+    database = omlite.get_class_meta(storable_class).database
+    return _run_in_turn(database, function, *args)
+
+
+def _run_for_object(object, function, *args):
+    return _run_for_class(object.__class__, function, object, *args)
+
+
+async def aconnect(database, dbref):
+    ''' Connect :database on its own thread, so that thread owns it '''
+    await run_in_executor(database, database.connect, dbref)
+
+
+async def aget(storable_class, id):
+    return await _run_for_class(storable_class, omlite.get, storable_class, id)
+
+
+async def aget_many(storable_class, ids):
+    return await _run_for_class(
+        storable_class, omlite.get_many, storable_class, list(ids))
+
+
+async def afilter(storable_class, sql_predicate, *params):
+    ''' I am streaming objects from database in batches.
+    '''
+    objects = omlite.filter(storable_class, sql_predicate, *params)
+    next_batch = functools.partial(
+        _run_for_class, storable_class,
+        lambda: list(itertools.islice(objects, BATCH_SIZE)))
+    try:
+        while True:
+            batch = await next_batch()
+            if not batch:
+                return
+            for obj in batch:
+                yield obj
+    finally:
+        # the cursor must be closed on its own thread
+        await _run_for_class(storable_class, objects.close)
+
+
+def aget_all(storable_class):
+    # see https://www.sqlite.org/datatype3.html
+    true = 1
+    return afilter(storable_class, true)
+
+
+async def asave(object):
+    await _run_for_object(object, omlite.save)
+
+
+async def acreate(object):
+    await _run_for_object(object, omlite.create)
+
+
+async def adelete(object):
+    await _run_for_object(object, omlite.delete)
+
+
+async def acreate_many(objects):
+    objects_by_database = {}
+    for object in objects:
+        database = omlite.get_meta(object).database
+        objects_by_database.setdefault(database, []).append(object)
+    for database, objects in objects_by_database.items():
+        await _run_in_turn(database, omlite.create_many, objects)
+
+
+class atransaction(object):
+    '''
+    async with atransaction(db):
+        ...
+    '''
+
+    def __init__(self, database):
+        self.database = database
+        self.transaction = None
+        self._lock = None
+        self._token = None
+
+    async def __aenter__(self):
+        open_transactions = _open_transactions.get()
+        if self.database not in open_transactions:
+            # nested transactions of the task already hold the lock
+            self._lock = _transaction_lock(self.database)
+            await self._lock.acquire()
+        self._token = _open_transactions.set(
+            open_transactions | frozenset([self.database]))
+        try:
+            self.transaction = self.database.transaction()
+            await run_in_executor(self.database, self.transaction.__enter__)
+        except BaseException:
+            self._release()
+            raise
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        try:
+            return await run_in_executor(
+                self.database,
+                self.transaction.__exit__, exc_type, exc_value, traceback)
+        finally:
+            self._release()
+
+    def _release(self):
+        _open_transactions.reset(self._token)
+        if self._lock is not None:
+            self._lock.release()
+            self._lock = None
@@ -0,0 +1,205 @@
+import asyncio
+import threading
+import unittest
+
+from omlite import Database, Field, database, table_name
+from omlite import storable_pk_autoinc
+import omlite as m
+import omlite_async as am
+
+
+adb = Database(None)
+
+
+@database(adb)
+@table_name('aa')
+@storable_pk_autoinc
+class A(object):
+    a = Field()
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def make(cls, **attrs):
+    obj = cls()
+    for attr, value in attrs.items():
+        setattr(obj, attr, value)
+    return obj
+
+
+def in_db_thread(function):
+    return am.get_executor(adb).submit(function).result()
+
+
+class TestException(Exception):
+    pass
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        run(am.aconnect(adb, ':memory:'))
+        in_db_thread(lambda: adb.connection.executescript(
+            '''\
+            create table aa(id integer primary key, a);
+            insert into aa(id, a) values (0, 'A() in db at 0');
+            insert into aa(id, a) values (1, 'A() in db at 1');
+            '''))
+
+    def count(self):
+        return in_db_thread(lambda: len(list(m.get_all(A))))
+
+
+class Test_crud(TestCase):
+
+    def test_connection_is_owned_by_db_thread(self):
+        main_thread = threading.current_thread()
+        owner = in_db_thread(threading.current_thread)
+
+        self.assertIsNot(main_thread, owner)
+        self.assertIsNotNone(in_db_thread(lambda: m.get(A, 0)))
+
+    def test_get(self):
+        a = run(am.aget(A, 1))
+
+        self.assertEqual('A() in db at 1', a.a)
+
+    def test_get_missing(self):
+        self.assertRaises(LookupError, run, am.aget(A, 5))
+
+    def test_get_many(self):
+        a1, a0 = run(am.aget_many(A, [1, 0]))
+
+        self.assertEqual(1, a1.id)
+        self.assertEqual(0, a0.id)
+
+    def test_save(self):
+        a = make(A, a='new')
+        run(am.asave(a))
+
+        self.assertEqual('new', run(am.aget(A, a.id)).a)
+
+    def test_create_many(self):
+        run(am.acreate_many([make(A, a='new'), make(A, a='new')]))
+
+        self.assertEqual(4, self.count())
+
+    def test_delete(self):
+        a = run(am.aget(A, 0))
+        run(am.adelete(a))
+
+        self.assertEqual(1, self.count())
+
+
+class Test_afilter(TestCase):
+
+    def collect(self, objects):
+        async def collect():
+            return [obj async for obj in objects]
+        return run(collect())
+
+    def test_filter(self):
+        a, = self.collect(am.afilter(A, 'a like ?', '%1'))
+
+        self.assertEqual(1, a.id)
+
+    def test_streamed_in_batches(self):
+        count = 2 * am.BATCH_SIZE + 1
+        in_db_thread(
+            lambda: m.create_many(make(A, a=i) for i in range(count)))
+
+        self.assertEqual(count + 2, len(self.collect(am.aget_all(A))))
+
+    def test_query_advisor(self):
+        advisor = adb.enable_query_advisor()
+        try:
+            a, = self.collect(am.afilter(A, 'a like ?', '%1'))
+        finally:
+            adb.disable_query_advisor()
+
+        self.assertEqual(1, a.id)
+        self.assertEqual(1, len(advisor.report()))
+
+    def test_early_exit(self):
+        async def first():
+            async for obj in am.aget_all(A):
+                return obj
+        self.assertIsNotNone(run(first()))
+
+
+class Test_atransaction(TestCase):
+
+    def test_commit(self):
+        async def create():
+            async with adb.atransaction():
+                await am.asave(make(A, a='new'))
+        run(create())
+
+        self.assertEqual(3, self.count())
+
+    def test_exception_rolls_back(self):
+        async def create():
+            async with am.atransaction(adb):
+                await am.asave(make(A, a='new'))
+                raise TestException()
+        self.assertRaises(TestException, run, create())
+
+        self.assertEqual(2, self.count())
+
+    def test_other_tasks_wait_for_transaction(self):
+        events = []
+
+        async def failing_transaction(started):
+            async with adb.atransaction():
+                await am.asave(make(A, a='rolled back'))
+                started.set()
+                await asyncio.sleep(0.05)
+                events.append('rollback')
+                raise TestException()
+
+        async def save(started):
+            await started.wait()
+            await am.asave(make(A, a='saved'))
+            events.append('saved')
+
+        async def main():
+            started = asyncio.Event()
+            return await asyncio.gather(
+                failing_transaction(started), save(started),
+                return_exceptions=True)
+        failed, _ = run(main())
+
+        self.assertIsInstance(failed, TestException)
+        self.assertEqual(['rollback', 'saved'], events)
+        self.assertEqual(
+            ['saved'],
+            in_db_thread(lambda: [a.a for a in m.filter(A, 'id > 1')]))
+
+    def test_tasks_created_within_transaction_join_it(self):
+        async def create():
+            async with adb.atransaction():
+                await asyncio.gather(
+                    am.asave(make(A, a='new')), am.asave(make(A, a='new')))
+        run(create())
+
+        self.assertEqual(4, self.count())
+
+    def test_nested(self):
+        async def create():
+            async with adb.atransaction():
+                await am.asave(make(A, a='outer'))
+                async with adb.atransaction():
+                    await am.asave(make(A, a='inner'))
+        run(create())
+
+        self.assertEqual(4, self.count())
+
+
+if __name__ == '__main__':
+    unittest.main()
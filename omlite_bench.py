@@ -0,0 +1,331 @@
+'''
+Benchmarks of the omlite CRUD paths, with raw sqlite3 as baseline.
+
+    python omlite_bench.py [--sizes 1000,10000] [--widths 1,10]
+                           [--repeat 3] [--output results.json]
+
+Every (backend, key, size, width) case runs on a fresh database:
+backend is ':memory:' or a temporary file, key is one of KEYS,
+size is the number of rows, width is the number of data columns.
+
+The result is JSON, best of --repeat runs for each measurement:
+
+    {"environment": {...},
+     "results": [{"backend": "memory", "key": "autoinc", "rows": 1000,
+                  "width": 1, "operation": "get", "impl": "omlite",
+                  "seconds": 0.01, "ops_per_sec": 100000.0}, ...]}
+
+For the file backend the size of the populated database is also
+reported, as operation "file_size" with "bytes" instead of timings.
+'''
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+
+import omlite as m
+
+
+clock = m.clock
+
+OPERATIONS = ('create', 'get', 'filter', 'save', 'delete', 'transaction')
+# primary key kinds: storable decorator, sqlite3 id declaration and factory
+KEYS = {
+    'autoinc': (m.storable_pk_autoinc, 'integer', lambda: None),
+    'uuid': (
+        m.storable_pk_random_uuid4, 'varchar', lambda: str(uuid.uuid4())),
+    'uuid7': (m.storable_pk_uuid7, 'varchar', lambda: str(m.uuid7())),
+    'binary_uuid4': (
+        m.storable_pk_binary_uuid4, 'blob',
+        lambda: m.BLOB(uuid.uuid4().bytes)),
+    'binary_uuid7': (
+        m.storable_pk_binary_uuid7, 'blob', lambda: m.BLOB(m.uuid7().bytes)),
+}
+# depth of nested transactions in the transaction benchmark
+NESTING = 5
+
+
+def make_class(database, key, width):
+    attrs = dict(('f{}'.format(i), m.Field()) for i in range(width))
+    cls = KEYS[key][0](type('Bench', (object,), attrs))
+    return m.table_name('bench')(m.database(database)(cls))
+
+
+def new_object(cls, width, i):
+    obj = cls()
+    for f in range(width):
+        setattr(obj, 'f{}'.format(f), i)
+    return obj
+
+
+def best_of(repeat, setup, function):
+    '''
+    Return the minimum elapsed time of function(setup()).
+
+    setup() returns a tuple, its first item is closed after the run.
+    '''
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        start = clock()
+        function(args)
+        times.append(clock() - start)
+        args[0].close()
+    return min(times)
+
+
+class Case(object):
+
+    def __init__(self, backend, key, rows, width, directory):
+        self.backend = backend
+        self.key = key
+        self.rows = rows
+        self.width = width
+        self.directory = directory
+        self.columns = ['f{}'.format(i) for i in range(width)]
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, 'bench.sqlite')
+
+    def dbref(self):
+        if self.backend == 'memory':
+            return ':memory:'
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        return self.path
+
+    def result(self, operation, impl, seconds, count):
+        return {
+            'backend': self.backend, 'key': self.key,
+            'rows': self.rows, 'width': self.width,
+            'operation': operation, 'impl': impl,
+            'seconds': seconds,
+            'ops_per_sec': count / seconds if seconds else None}
+
+    # omlite
+    def omlite_db(self, populated=True):
+        ''' Return (database, class, stored objects) '''
+        database = m.Database(self.dbref())
+        cls = make_class(database, self.key, self.width)
+        m.create_table(cls)
+        objects = []
+        if populated:
+            objects = [
+                new_object(cls, self.width, i) for i in range(self.rows)]
+            m.create_many(objects)
+        return database, cls, objects
+
+    def bench_omlite(self, repeat):
+        rows, width = self.rows, self.width
+
+        def create(args):
+            database, cls, _ = args
+            with database.transaction():
+                for i in range(rows):
+                    m.create(new_object(cls, width, i))
+
+        def get(args):
+            _, cls, objects = args
+            ids = [obj.id for obj in objects]
+            random.shuffle(ids)
+            for id in ids:
+                m.get(cls, id)
+
+        def filter(args):
+            _, cls, _ = args
+            for _ in m.filter(cls, '1'):
+                pass
+
+        def save(args):
+            database, _, objects = args
+            with database.transaction():
+                for obj in objects:
+                    obj.f0 = -1
+                    m.save(obj)
+
+        def delete(args):
+            database, _, objects = args
+            with database.transaction():
+                for obj in objects:
+                    m.delete(obj)
+
+        def transaction(args):
+            database, _, _ = args
+
+            def nest(depth):
+                with database.transaction():
+                    if depth:
+                        nest(depth - 1)
+            for _ in range(rows):
+                nest(NESTING - 1)
+
+        return self.measure('omlite', repeat, self.omlite_db, locals())
+
+    # raw sqlite3
+    def sqlite3_db(self, populated=True):
+        ''' Return (connection, ids) '''
+        connection = sqlite3.connect(self.dbref(), isolation_level=None)
+        id_type = KEYS[self.key][1]
+        connection.execute('CREATE TABLE bench(id {} PRIMARY KEY{})'.format(
+            id_type, ''.join(', ' + column for column in self.columns)))
+        ids = []
+        if populated:
+            connection.execute('BEGIN')
+            for i in range(self.rows):
+                ids.append(self.sqlite3_insert(connection, i))
+            connection.execute('COMMIT')
+        return connection, ids
+
+    def sqlite3_insert(self, connection, i):
+        id = KEYS[self.key][2]()
+        cursor = connection.execute(
+            'INSERT INTO bench(id, {}) VALUES (?{})'.format(
+                ', '.join(self.columns), ', ?' * self.width),
+            [id] + [i] * self.width)
+        return cursor.lastrowid if id is None else id
+
+    def bench_sqlite3(self, repeat):
+        rows = self.rows
+        select = 'SELECT id, {} FROM bench'.format(', '.join(self.columns))
+
+        def create(args):
+            connection, _ = args
+            connection.execute('BEGIN')
+            for i in range(rows):
+                self.sqlite3_insert(connection, i)
+            connection.execute('COMMIT')
+
+        def get(args):
+            connection, ids = args
+            random.shuffle(ids)
+            sql = select + ' WHERE id=?'
+            for id in ids:
+                connection.execute(sql, [id]).fetchone()
+
+        def filter(args):
+            connection, _ = args
+            for _ in connection.execute(select):
+                pass
+
+        def save(args):
+            connection, ids = args
+            connection.execute('BEGIN')
+            for id in ids:
+                connection.execute(
+                    'UPDATE bench SET f0=? WHERE id=?', [-1, id])
+            connection.execute('COMMIT')
+
+        def delete(args):
+            connection, ids = args
+            connection.execute('BEGIN')
+            for id in ids:
+                connection.execute('DELETE FROM bench WHERE id=?', [id])
+            connection.execute('COMMIT')
+
+        def transaction(args):
+            connection, _ = args
+            for _ in range(rows):
+                for depth in range(NESTING):
+                    connection.execute('SAVEPOINT s{}'.format(depth))
+                for depth in reversed(range(NESTING)):
+                    connection.execute('RELEASE SAVEPOINT s{}'.format(depth))
+
+        return self.measure('sqlite3', repeat, self.sqlite3_db, locals())
+
+    def measure(self, impl, repeat, new_db, functions):
+        ''' Run functions[operation] for all OPERATIONS '''
+        results = []
+        for operation in OPERATIONS:
+            populated = operation not in ('create', 'transaction')
+            seconds = best_of(
+                repeat, lambda: new_db(populated), functions[operation])
+            results.append(self.result(operation, impl, seconds, self.rows))
+        if self.backend == 'file':
+            database = new_db(True)[0]
+            database.close()
+            result = self.result('file_size', impl, None, self.rows)
+            result['bytes'] = os.path.getsize(self.path)
+            results.append(result)
+        return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def run(sizes, widths, backends, keys, repeat):
+    directory = tempfile.mkdtemp(prefix='omlite_bench')
+    results = []
+    try:
+        for backend in backends:
+            for key in keys:
+                for rows in sizes:
+                    for width in widths:
+                        case = Case(backend, key, rows, width, directory)
+                        results.extend(case.bench_omlite(repeat))
+                        results.extend(case.bench_sqlite3(repeat))
+    finally:
+        shutil.rmtree(directory)
+    return {'environment': environment(), 'results': results}
+
+
+def positive_int_list(text):
+    values = [int(value) for value in text.split(',')]
+    for value in values:
+        if value < 1:
+            raise argparse.ArgumentTypeError(
+                'expected positive integers, got {}'.format(value))
+    return values
+
+
+def key_list(text):
+    keys = text.split(',')
+    for key in keys:
+        if key not in KEYS:
+            raise argparse.ArgumentTypeError('unknown key {!r}'.format(key))
+    return keys
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        '--sizes', type=positive_int_list, default=[1000, 10000])
+    parser.add_argument('--widths', type=positive_int_list, default=[1, 10])
+    parser.add_argument(
+        '--backends', type=lambda text: text.split(','),
+        default=['memory', 'file'])
+    parser.add_argument(
+        '--keys', type=key_list, default=sorted(KEYS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='JSON file (default: stdout)')
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.widths, args.backends, args.keys,
+                 args.repeat)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=1, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=1, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,16 @@
+import datetime
+import decimal
+import io
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
+import uuid
 
 from omlite import db, Field
 from omlite import storable_pk_autoinc, storable_pk_netaddrtime_uuid1
@@ -70,6 +82,28 @@ class Test_meta(unittest.TestCase):
         self.assertEqual('aa', get_class_meta(A).table_name)
         self.assertEqual('bs', get_class_meta(B).table_name)
 
+    def test_statements_are_cached(self):
+        meta = get_class_meta(A)
+        self.assertIs(meta.statements, meta.statements)
+        self.assertEqual(
+            'DELETE FROM aa WHERE id=?', meta.statements.delete)
+
+    def test_statements_follow_table_name(self):
+        @storable_pk_autoinc
+        class C(object):
+            c = Field()
+
+        meta = get_class_meta(C)
+        self.assertEqual('DELETE FROM cs WHERE id=?', meta.statements.delete)
+
+        table_name('renamed')(C)
+
+        self.assertEqual(
+            'DELETE FROM renamed WHERE id=?', meta.statements.delete)
+        self.assertEqual(
+            'SELECT * FROM renamed WHERE c=?',
+            meta.statements.select_where('c=?'))
+
 
 class Test_storable_READ(TestCase):
 
@@ -86,6 +120,9 @@ class Test_storable_READ(TestCase):
         self.assertEqual('B() in db at 2', b.b)
         self.assertIsInstance(b, B)
 
+    def test_missing_id(self):
+        self.assertRaises(LookupError, m.get, A, 3)
+
     def test_filter(self):
         objects = list(m.filter(A, 'a like "%1"'))
         a, = objects
@@ -98,6 +135,325 @@ class Test_storable_READ(TestCase):
         self.assertEqual(1, a1.id)
 
 
+class Test_upsert(TestCase):
+
+    def test_insert(self):
+        m.upsert(make(A, id=5, a='new'))
+
+        self.assertEqual('new', m.get(A, 5).a)
+
+    def test_update(self):
+        a = make(A, id=0, a='upserted')
+        m.upsert(a)
+
+        self.assertEqual('upserted', m.get(A, 0).a)
+        self.assertFalse(m.is_dirty(a))
+
+    def test_update_only_given_fields(self):
+        db.connection.execute("UPDATE x SET a='kept' WHERE id=2")
+        ab = make(AB, id=2, a='ignored', b='upserted')
+        m.upsert(ab, fields=['b'])
+
+        from_db = m.get(AB, 2)
+        self.assertEqual(('kept', 'upserted'), (from_db.a, from_db.b))
+        # the row is not known, so all fields are written on save
+        self.assertTrue(m.is_dirty(ab))
+
+    def test_no_fields_keeps_existing_row(self):
+        m.upsert(make(A, id=0, a='ignored'), fields=[])
+
+        self.assertEqual('A() in db at 0', m.get(A, 0).a)
+
+    def test_unknown_field(self):
+        self.assertRaises(
+            ValueError, m.upsert, make(A, id=0, a='x'), fields=['aa'])
+
+    def test_object_without_id_is_created(self):
+        a = make(A, a='new')
+        m.upsert(a)
+
+        self.assertEqual('new', m.get(A, a.id).a)
+
+    def test_upsert_many(self):
+        objects = [
+            make(A, id=1, a='updated'), make(A, id=7, a='inserted'),
+            make(A, a='created'), make(F, id=TEST_UUID, future='updated')]
+        m.upsert_many(objects)
+
+        self.assertEqual(
+            ['A() in db at 0', 'updated', 'created', 'inserted'],
+            [a.a for a in m.filter(A, '1 ORDER BY id')])
+        self.assertEqual('updated', m.get(F, TEST_UUID).future)
+
+    def test_upsert_many_is_one_transaction(self):
+        objects = [make(A, id=1, a='updated'), make(B, id='x', b='x')]
+        self.assertRaises(m.IntegrityError, m.upsert_many, objects)
+
+        self.assertEqual('A() in db at 1', m.get(A, 1).a)
+
+
+@storable_pk_autoinc
+class UniqueName(object):
+    name = Field(index='unique')
+
+
+class Test_unit_of_work(TestCase):
+
+    def setUp(self):
+        super(Test_unit_of_work, self).setUp()
+        self.events = db.add_hook([].append).__self__
+
+    def tearDown(self):
+        for hook in db.hooks:
+            db.remove_hook(hook)
+
+    def writes(self):
+        return [
+            (e.operation, e.table, e.rows) for e in self.events
+            if e.sql and e.sql.split()[0] in ('INSERT', 'UPDATE', 'DELETE')]
+
+    def test_changes_are_written_on_exit(self):
+        with db.unit_of_work():
+            a = m.get(A, 0)
+            a.a = 'changed'
+            m.save(a)
+            m.create(make(A, a='new'))
+            m.delete(m.get(B, 0))
+            self.assertEqual([], self.writes())
+
+        self.assertEqual(
+            [('update', 'aa', 1), ('create', 'aa', 1), ('delete', 'bs', 1)],
+            self.writes())
+        self.assertEqual(
+            ['changed', 'A() in db at 1', 'new'],
+            [a.a for a in m.filter(A, '1 ORDER BY id')])
+        self.assertRaises(LookupError, m.get, B, 0)
+
+    def test_repeated_saves_are_coalesced(self):
+        with db.unit_of_work():
+            a = m.get(A, 0)
+            for i in range(3):
+                a.a = i
+                m.save(a)
+
+        self.assertEqual([('update', 'aa', 1)], self.writes())
+        self.assertEqual(2, m.get(A, 0).a)
+        self.assertFalse(m.is_dirty(a))
+
+    def test_same_changes_are_written_together(self):
+        with db.unit_of_work():
+            for a in m.get_all(A):
+                a.a = 'changed'
+                m.save(a)
+            m.create_many([make(A, a=1), make(A, a=2)])
+            m.create(make(B, b=3))
+
+        self.assertEqual(
+            [('update', 'aa', 2), ('create', 'aa', 2), ('create', 'bs', 1)],
+            self.writes())
+        self.assertEqual(4, len(list(m.get_all(A))))
+
+    def test_order_of_changes_is_kept(self):
+        with db.unit_of_work():
+            m.create(make(A, a=1))
+            m.create(make(B, b=2))
+            m.create(make(A, a=3))
+            m.delete(m.get(A, 0))
+            m.create(make(A, a=4))
+
+        self.assertEqual(
+            [('create', 'aa', 1), ('create', 'bs', 1), ('create', 'aa', 1),
+             ('delete', 'aa', 1), ('create', 'aa', 1)],
+            self.writes())
+
+    def test_delete_before_create_with_same_unique_value(self):
+        m.create_table(UniqueName)
+        old = make(UniqueName, name='x')
+        m.create(old)
+
+        with db.unit_of_work():
+            m.delete(old)
+            m.create(make(UniqueName, name='x'))
+
+        new, = m.get_all(UniqueName)
+        self.assertEqual('x', new.name)
+
+    def test_get_sees_buffered_changes(self):
+        with db.unit_of_work():
+            a = m.get(A, 0)
+            a.a = 'changed'
+            m.save(a)
+            new = make(A, id=5, a='new')
+            m.create(new)
+            m.delete(m.get(A, 1))
+
+            self.assertIs(a, m.get(A, 0))
+            self.assertIs(new, m.get(A, 5))
+            self.assertRaises(LookupError, m.get, A, 1)
+            # queries see only the database
+            self.assertEqual(
+                ['A() in db at 0', 'A() in db at 1'],
+                [a.a for a in m.filter(A, '1 ORDER BY id')])
+
+    def test_deleting_created_object_writes_nothing(self):
+        with db.unit_of_work():
+            a = make(A, a='new')
+            m.create(a)
+            m.delete(a)
+
+        self.assertEqual([], self.writes())
+        self.assertEqual(2, len(list(m.get_all(A))))
+
+    def test_recreate_after_delete_replaces_row(self):
+        with db.unit_of_work():
+            m.delete(m.get(A, 0))
+            m.create(make(A, id=0, a='replaced'))
+            self.assertEqual('replaced', m.get(A, 0).a)
+
+        self.assertEqual(
+            [('delete', 'aa', 1), ('create', 'aa', 1)], self.writes())
+        self.assertEqual('replaced', m.get(A, 0).a)
+
+    def test_values_are_captured_on_save(self):
+        m.create_table(UniqueName)
+        a = make(UniqueName, name='X')
+        m.create(a)
+
+        with db.unit_of_work():
+            a.name = 'Y'
+            m.save(a)
+            b = make(UniqueName, name='X')
+            m.create(b)
+            a.name = 'Y2'
+            m.save(a)
+            a.name = 'not saved'
+
+        self.assertEqual('Y2', m.get(UniqueName, a.id).name)
+        self.assertEqual('X', m.get(UniqueName, b.id).name)
+        self.assertEqual(('name',), m.changed_fields(a))
+
+    def test_delete_of_object_created_earlier(self):
+        with db.unit_of_work():
+            a = make(A, a='new')
+            m.create(a)
+            m.create(make(B, b='new'))
+            m.delete(a)
+
+        self.assertIsNone(a.id)
+        self.assertEqual(2, len(list(m.get_all(A))))
+        self.assertEqual(3, len(list(m.get_all(B))))
+
+    def test_transaction_within_unit_can_roll_back(self):
+        with db.unit_of_work():
+            m.create(make(A, a='buffered'))
+            try:
+                with db.transaction():
+                    m.create(make(A, a='rolled back'))
+                    raise TestException()
+            except TestException:
+                pass
+
+        self.assertEqual(
+            ['buffered'], [a.a for a in m.filter(A, 'id > 1')])
+
+    def test_upsert_follows_buffered_changes(self):
+        with db.unit_of_work():
+            m.delete_but_keep_id(m.get(A, 0))
+            m.upsert(make(A, id=0, a='upserted'))
+
+        self.assertEqual('upserted', m.get(A, 0).a)
+
+    def test_update_where_follows_buffered_changes(self):
+        with db.unit_of_work():
+            m.create(make(A, a='new'))
+            m.update_where(A, {'a': 'updated'}, 'a=?', 'new')
+            m.delete(m.get(A, 0))
+            m.delete_where(A, 'id=1')
+
+        self.assertEqual(
+            ['updated'], [a.a for a in m.get_all(A)])
+
+    def test_flush(self):
+        with db.unit_of_work() as unit:
+            m.create(make(A, a='new'))
+            self.assertEqual(1, len(unit))
+            unit.flush()
+
+            self.assertEqual(0, len(unit))
+            self.assertEqual(3, len(list(m.get_all(A))))
+
+    def test_exception_discards_changes(self):
+        def change():
+            with db.unit_of_work():
+                m.create(make(A, a='new'))
+                m.delete(m.get(A, 0))
+                raise TestException()
+        self.assertRaises(TestException, change)
+
+        self.assertEqual([], self.writes())
+        self.assertEqual(2, len(list(m.get_all(A))))
+        self.assertIsNone(db.current_unit_of_work())
+
+    def test_nested_units_are_joined(self):
+        with db.unit_of_work() as outer:
+            with db.unit_of_work() as inner:
+                m.create(make(A, a='new'))
+            self.assertIs(outer, inner)
+            self.assertEqual([], self.writes())
+
+        self.assertEqual([('create', 'aa', 1)], self.writes())
+
+    def test_other_threads_are_not_buffered(self):
+        with db.unit_of_work():
+            thread = threading.Thread(
+                target=lambda: self.units.append(db.current_unit_of_work()))
+            self.units = []
+            thread.start()
+            thread.join()
+
+        self.assertEqual([None], self.units)
+
+
+class Test_get_many(TestCase):
+
+    def test_objects_are_returned_in_request_order(self):
+        a1, a0 = m.get_many(A, [1, 0])
+
+        self.assertEqual('A() in db at 1', a1.a)
+        self.assertEqual('A() in db at 0', a0.a)
+
+    def test_repeated_ids(self):
+        objects = m.get_many(A, [1, 0, 1])
+
+        self.assertEqual([1, 0, 1], [a.id for a in objects])
+
+    def test_missing_ids_are_reported(self):
+        try:
+            m.get_many(A, [3, 0, 2])
+        except LookupError as e:
+            self.assertEqual((A, [3, 2]), e.args)
+            return
+        self.fail('expected LookupError was not raised')
+
+    def test_more_ids_than_bound_parameters(self):
+        if hasattr(db.connection, 'setlimit'):
+            db.connection.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 10)
+        count = 2 * db.max_variable_number() + 1
+        m.create_many(make(A, id=i, a=i) for i in range(2, count))
+        ids = list(reversed(range(count)))
+
+        self.assertEqual(ids, [a.id for a in m.get_many(A, ids)])
+
+    def test_id_chunks(self):
+        self.assertEqual([[1]], list(m._id_chunks([1], 4)))
+        self.assertEqual([[1, 2, 3, 3]], list(m._id_chunks([1, 2, 3], 4)))
+        self.assertEqual(
+            [[1, 2, 3, 4], [5]], list(m._id_chunks([1, 2, 3, 4, 5], 4)))
+        self.assertEqual(
+            [[1, 2, 3, 4], [5, 6, 7, 7]],
+            list(m._id_chunks([1, 2, 3, 4, 5, 6, 7], 6)))
+
+
 class Test_storable_CREATE(TestCase):
 
     def test(self):
@@ -128,6 +484,67 @@ class Test_storable_CREATE(TestCase):
         self.assertEqual('succeeded', a_from_db.a)
 
 
+class Test_create_many(TestCase):
+
+    def test_autoincrement_ids_are_assigned(self):
+        a1 = make(A, a='first')
+        a2 = make(A, a='second')
+        m.create_many([a1, a2])
+
+        self.assertEqual(a1.id + 1, a2.id)
+        self.assertEqual('first', m.get(A, a1.id).a)
+        self.assertEqual('second', m.get(A, a2.id).a)
+
+    def test_prefilled_ids_are_kept(self):
+        a1 = make(A, id=8080, a='with id')
+        a2 = make(A, a='without id')
+        m.create_many([a2, a1])
+
+        self.assertEqual(8080, a1.id)
+        self.assertEqual(8081, a2.id)
+        self.assertEqual('with id', m.get(A, 8080).a)
+        self.assertEqual('without id', m.get(A, 8081).a)
+
+    def test_uuid_ids_are_generated(self):
+        f1 = make(F, future='first')
+        f2 = make(F, future='second')
+        m.create_many([f1, f2])
+
+        self.assertNotEqual(f1.id, f2.id)
+        self.assertEqual('first', m.get(F, f1.id).future)
+        self.assertEqual('second', m.get(F, f2.id).future)
+
+    def test_mixed_classes(self):
+        a = make(A, a='new A')
+        b = make(B, b='new B')
+        f = make(F, future='new F')
+        m.create_many([a, b, f])
+
+        self.assertEqual('new A', m.get(A, a.id).a)
+        self.assertEqual('new B', m.get(B, b.id).b)
+        self.assertEqual('new F', m.get(F, f.id).future)
+
+    def test_failure_rolls_back_all_objects(self):
+        a = make(A, a='new A')
+        duplicate = make(B, id=0, b='duplicate')
+        self.assertRaises(
+            m.IntegrityError, m.create_many, [a, duplicate])
+
+        self.assertEqual(2, len(list(m.get_all(A))))
+        self.assertEqual('B() in db at 0', m.get(B, 0).b)
+
+
+    def test_ids_not_generated_consecutively_roll_back(self):
+        db.connection.execute(
+            """create trigger gone after insert on aa when new.a = 'gone'
+            begin delete from aa where id = new.id; end""")
+        self.assertRaises(
+            m.IntegrityError, m.create_many,
+            [make(A, a='kept'), make(A, a='gone')])
+
+        self.assertEqual(2, len(list(m.get_all(A))))
+
+
 class Test_storable_UPDATE(TestCase):
 
     def test(self):
@@ -140,6 +557,171 @@ class Test_storable_UPDATE(TestCase):
         self.assertNotEqual(id(a), id(a_from_db))
 
 
+class Test_dirty_tracking(TestCase):
+
+    def sql_update_b(self, id, b):
+        db.connection.execute('update x set b=? where id=?', (b, id))
+
+    def test_read_object_is_clean(self):
+        ab = m.get(AB, 2)
+
+        self.assertFalse(m.is_dirty(ab))
+        self.assertEqual((), m.changed_fields(ab))
+
+    def test_changed_fields(self):
+        ab = m.get(AB, 2)
+        ab.a = 'changed'
+        ab.x = 'changed'
+
+        self.assertTrue(m.is_dirty(ab))
+        self.assertEqual(('a', 'x'), m.changed_fields(ab))
+
+    def test_saved_object_is_clean(self):
+        ab = m.get(AB, 2)
+        ab.a = 'changed'
+        m.save(ab)
+
+        self.assertFalse(m.is_dirty(ab))
+
+    def test_created_object_is_clean(self):
+        ab = make(AB, a='new')
+        self.assertTrue(m.is_dirty(ab))
+
+        m.save(ab)
+
+        self.assertFalse(m.is_dirty(ab))
+
+    def test_clean_object_is_not_written(self):
+        ab = m.get(AB, 2)
+        self.sql_update_b(2, 'changed in db')
+
+        m.save(ab)
+
+        self.assertEqual('changed in db', m.get(AB, 2).b)
+
+    def test_only_changed_fields_are_written(self):
+        ab = m.get(AB, 2)
+        ab.a = 'changed'
+        self.sql_update_b(2, 'changed in db')
+
+        m.save(ab)
+
+        ab_from_db = m.get(AB, 2)
+        self.assertEqual('changed', ab_from_db.a)
+        self.assertEqual('changed in db', ab_from_db.b)
+
+    def test_object_not_read_is_fully_written(self):
+        ab = make(AB, id=2, a='new a')
+        self.assertEqual(('a', 'b', 'x'), m.changed_fields(ab))
+
+        m.save(ab)
+
+        ab_from_db = m.get(AB, 2)
+        self.assertEqual('new a', ab_from_db.a)
+        self.assertIsNone(ab_from_db.b)
+
+
+class Test_deferred_fields(TestCase):
+
+    def setUp(self):
+        super(Test_deferred_fields, self).setUp()
+        db.connection.execute(
+            "insert into x(id, a, b, x) values (3, 'a3', 'b3', 'x3')")
+
+    def sql_update_b(self, id, b):
+        db.connection.execute('update x set b=? where id=?', (b, id))
+
+    def test_only_selected_fields_are_read(self):
+        ab, = m.filter(AB, 'id=3', fields=['a'])
+
+        self.assertEqual(
+            set(['id', 'a']), set(ab.__dict__) & set(['id', 'a', 'b', 'x']))
+
+    def test_deferred_field_is_read_on_access(self):
+        ab, = m.filter(AB, 'id=3', defer=['b', 'x'])
+        self.sql_update_b(3, 'changed in db')
+
+        self.assertEqual('a3', ab.a)
+        self.assertEqual('changed in db', ab.b)
+        self.assertEqual('x3', ab.x)
+
+    def test_get_with_fields(self):
+        ab = m.get(AB, 3, fields=['x'])
+
+        self.assertNotIn('a', ab.__dict__)
+        self.assertEqual('x3', ab.x)
+        self.assertEqual('a3', ab.a)
+
+    def test_get_many_with_defer(self):
+        ab2, ab3 = m.get_many(AB, [2, 3], defer=['a'])
+
+        self.assertNotIn('a', ab3.__dict__)
+        self.assertEqual('a3', ab3.a)
+        self.assertIsNone(ab2.a)
+
+    def test_save_does_not_overwrite_deferred_fields(self):
+        ab = m.get(AB, 3, defer=['b'])
+        self.sql_update_b(3, 'changed in db')
+        ab.a = 'changed'
+        m.save(ab)
+
+        ab_from_db = m.get(AB, 3)
+        self.assertEqual('changed', ab_from_db.a)
+        self.assertEqual('changed in db', ab_from_db.b)
+
+    def test_loaded_deferred_field_is_tracked(self):
+        ab = m.get(AB, 3, fields=['a'])
+        self.assertEqual('b3', ab.b)
+        self.assertFalse(m.is_dirty(ab))
+
+        ab.b = 'changed'
+        self.assertEqual(('b',), m.changed_fields(ab))
+        m.save(ab)
+
+        self.assertEqual('changed', m.get(AB, 3).b)
+
+    def test_assigned_deferred_field_is_saved(self):
+        ab = m.get(AB, 3, fields=['a'])
+        ab.b = 'changed'
+        self.assertEqual(('b',), m.changed_fields(ab))
+        m.save(ab)
+
+        self.assertFalse(m.is_dirty(ab))
+        self.assertEqual('changed', m.get(AB, 3).b)
+        self.assertEqual('changed', ab.b)
+
+    def test_load_deferred_keeps_assigned_value(self):
+        ab = m.get(AB, 3, fields=['a'])
+        ab.b = 'changed'
+        m.load_deferred([ab])
+
+        self.assertEqual('changed', ab.b)
+        self.assertEqual(('b',), m.changed_fields(ab))
+
+    def test_load_deferred(self):
+        objects = list(m.filter(AB, 'id > 1', fields=['x']))
+        m.load_deferred(objects)
+        db.connection.execute('delete from x')
+
+        self.assertEqual(
+            [(None, 'X() in db at 2'), ('a3', 'b3')],
+            [(ab.a, ab.b) for ab in objects])
+
+    def test_load_some_deferred(self):
+        objects = list(m.filter(AB, 'id > 1', fields=['x']))
+        m.load_deferred(objects, ['b'])
+        db.connection.execute('delete from x')
+
+        self.assertEqual(
+            ['X() in db at 2', 'b3'], [ab.b for ab in objects])
+        self.assertRaises(LookupError, getattr, objects[0], 'a')
+
+    def test_invalid_projection(self):
+        self.assertRaises(ValueError, m.get, AB, 3, fields=['y'])
+        self.assertRaises(
+            TypeError, m.filter, AB, 'id=3', field=['a'])
+
+
 class Test_storable_DELETE(TestCase):
 
     def test_deleted(self):
@@ -167,6 +749,157 @@ class Test_storable_DELETE(TestCase):
         self.assertEqual(a.a, a_from_db.a)
 
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Test_raw_results(TestCase):
+
+    def setUp(self):
+        super(Test_raw_results, self).setUp()
+        m.create_many(
+            make(A, a=float(i)) for i in range(2 * m.FETCH_BATCH_SIZE))
+
+    def test_filter_rows(self):
+        rows = list(m.filter_rows(A, 'id < ?', 2))
+
+        self.assertEqual([('A() in db at 0', 0), ('A() in db at 1', 1)], rows)
+        self.assertEqual(tuple, type(rows[0]))
+
+    def test_filter_rows_fields(self):
+        rows = list(m.filter_rows(A, 'id < ?', 2, fields=['id']))
+
+        self.assertEqual([(0,), (1,)], rows)
+
+    def test_filter_rows_named(self):
+        row = next(m.filter_rows(AB, '1', fields=['id', 'b'], named=True))
+
+        self.assertEqual(2, row.id)
+        self.assertEqual('X() in db at 2', row.b)
+        self.assertEqual('ABRow', type(row).__name__)
+
+    def test_filter_columns(self):
+        columns = m.filter_columns(
+            A, 'id > ?', 1, fields=['a', 'id'], typecodes={'a': 'd'})
+
+        self.assertEqual(['a', 'id'], list(columns))
+        self.assertEqual('d', columns['a'].typecode)
+        self.assertEqual(
+            sum(range(2 * m.FETCH_BATCH_SIZE)), sum(columns['a']))
+        self.assertEqual(list, type(columns['id']))
+        self.assertEqual(2 * m.FETCH_BATCH_SIZE, len(columns['id']))
+
+    def test_filter_columns_empty(self):
+        columns = m.filter_columns(A, 'id < ?', 0)
+
+        self.assertEqual({'a': [], 'id': []}, dict(columns))
+
+    def test_unknown_fields(self):
+        self.assertRaises(
+            ValueError, list, m.filter_rows(A, '1', fields=['nope']))
+        self.assertRaises(
+            ValueError, m.filter_columns, A, '1', typecodes={'id': 'q'},
+            fields=['a'])
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_filter_columns_numpy(self):
+        columns = m.filter_columns(
+            A, 'id > ?', 1, typecodes={'a': 'd'}, numpy=True)
+
+        self.assertEqual(numpy.float64, columns['a'].dtype)
+
+
+class Test_iter_pages(TestCase):
+
+    def setUp(self):
+        super(Test_iter_pages, self).setUp()
+        m.delete_where(A, '1')
+        m.create_many(make(A, a=i % 3) for i in range(10))
+
+    def ids(self, pages):
+        return [[a.id for a in page.objects] for page in pages]
+
+    def test_pages(self):
+        pages = list(m.iter_pages(A, 'a > ?', 0, page_size=3))
+
+        self.assertEqual([[2, 3, 5], [6, 8, 9]], self.ids(pages))
+        self.assertEqual([5, 9], [page.after for page in pages])
+
+    def test_resume_after_token(self):
+        first = next(m.iter_pages(A, '1', page_size=4))
+
+        rest = m.iter_pages(A, '1', page_size=4, after=first.after)
+
+        self.assertEqual([[5, 6, 7, 8], [9, 10]], self.ids(rest))
+
+    def test_rows_changed_between_pages_are_not_skipped(self):
+        pages = m.iter_pages(A, '1', page_size=5)
+        next(pages)
+        m.delete_where(A, 'id <= 3')
+        m.create(make(A, a='new'))
+
+        self.assertEqual([[6, 7, 8, 9, 10], [11]], self.ids(pages))
+
+    def test_key(self):
+        pages = list(m.iter_pages(A, '1', page_size=4, key='a'))
+
+        self.assertEqual(
+            [[1, 4, 7, 10], [2, 5, 8, 3], [6, 9]], self.ids(pages))
+        self.assertEqual((0, 10), pages[0].after)
+
+    def test_projection_keeps_key(self):
+        page, = m.iter_pages(A, '1', key='a', fields=['id'])
+
+        self.assertEqual(frozenset(), m._get_deferred(page.objects[0]))
+
+    def test_unknown_key(self):
+        self.assertRaises(
+            ValueError, list, m.iter_pages(A, '1', key='nope'))
+
+    def test_no_pages(self):
+        self.assertEqual([], list(m.iter_pages(A, 'a = ?', 'nope')))
+
+
+class Test_set_based_statements(TestCase):
+
+    def test_update_where(self):
+        count = m.update_where(A, {'a': 'updated'}, 'id < ?', 5)
+
+        self.assertEqual(2, count)
+        self.assertEqual('updated', m.get(A, 0).a)
+        self.assertEqual('updated', m.get(A, 1).a)
+
+    def test_update_where_without_match(self):
+        count = m.update_where(A, {'a': 'updated'}, 'id > ?', 5)
+
+        self.assertEqual(0, count)
+        self.assertEqual('A() in db at 0', m.get(A, 0).a)
+
+    def test_update_where_multiple_fields(self):
+        count = m.update_where(AB, {'a': 'new a', 'b': 'new b'}, 'id=2')
+
+        self.assertEqual(1, count)
+        ab = m.get(AB, 2)
+        self.assertEqual('new a', ab.a)
+        self.assertEqual('new b', ab.b)
+
+    def test_update_where_invalid_fields(self):
+        self.assertRaises(
+            ValueError, m.update_where, A, {'b': 'x'}, 'id=0')
+        self.assertRaises(
+            ValueError, m.update_where, A, {'id': 5}, 'id=0')
+        self.assertEqual('A() in db at 0', m.get(A, 0).a)
+
+    def test_delete_where(self):
+        count = m.delete_where(A, 'a like ?', '%1')
+
+        self.assertEqual(1, count)
+        m.get(A, 0)
+        self.assertRaises(LookupError, m.get, A, 1)
+
+
 class Test_storable_inheritance(TestCase):
 
     def test_by_id(self):
@@ -236,6 +969,102 @@ class Test_Storable_with_UUID_primary_key(TestCase):
         self.assertEqual('?', from_db.future)
 
 
+@table_name('bfs')
+@m.storable_pk_binary_uuid4
+class BF(object):
+    future = Field()
+
+
+@table_name('bf7s')
+@m.storable_pk_binary_uuid7
+class BF7(object):
+    future = Field()
+
+
+class Test_binary_uuid_primary_key(TestCase):
+
+    def setUp(self):
+        super(Test_binary_uuid_primary_key, self).setUp()
+        m.create_table(BF)
+        m.create_table(BF7)
+        self.bf = make(BF, future='?')
+        m.create(self.bf)
+
+    def test_id_is_stored_as_16_bytes(self):
+        id, = db.connection.execute('SELECT id FROM bfs').fetchone()
+
+        self.assertEqual(16, len(id))
+        self.assertEqual(uuid.UUID(self.bf.id).bytes, bytes(id))
+
+    def test_get_with_str_or_uuid(self):
+        self.assertEqual(self.bf.id, m.get(BF, self.bf.id).id)
+        self.assertEqual(self.bf.id, m.get(BF, self.bf.id.upper()).id)
+        self.assertEqual(self.bf.id, m.get(BF, uuid.UUID(self.bf.id)).id)
+
+    def test_get_many(self):
+        other = make(BF, future='other')
+        m.create(other)
+        ids = [other.id, uuid.UUID(self.bf.id)]
+
+        self.assertEqual(
+            ['other', '?'], [bf.future for bf in m.get_many(BF, ids)])
+
+    def test_missing(self):
+        missing = str(uuid.uuid4())
+        self.assertRaises(LookupError, m.get, BF, missing)
+        self.assertRaises(LookupError, m.get_many, BF, [missing])
+
+    def test_update_and_delete(self):
+        bf = m.get(BF, self.bf.id)
+        bf.future = 'known'
+        m.save(bf)
+        self.assertEqual('known', m.get(BF, self.bf.id).future)
+
+        m.delete(bf)
+        self.assertRaises(LookupError, m.get, BF, self.bf.id)
+
+    def test_object_cache(self):
+        get_class_meta(BF).database = cached_db
+        try:
+            m.create_table(BF)
+            bf = make(BF, future='cached')
+            m.create(bf)
+            cached_db.connection.execute('DELETE FROM bfs')
+
+            self.assertEqual('cached', m.get(BF, bf.id.upper()).future)
+            m.delete(bf)
+            self.assertRaises(LookupError, m.get, BF, bf.id)
+        finally:
+            get_class_meta(BF).database = db
+
+    def test_uuid7_keys_are_increasing(self):
+        bfs = [make(BF7, future=i) for i in range(100)]
+        for bf in bfs:
+            m.create(bf)
+
+        ordered = [bf.future for bf in m.filter(BF7, '1 ORDER BY id')]
+        self.assertEqual(list(range(100)), ordered)
+
+    def test_uuid7_layout(self):
+        before = int(time.time() * 1000)
+        id = m.uuid7()
+        after = int(time.time() * 1000)
+
+        self.assertEqual(7, id.int >> 76 & 0xf)
+        self.assertEqual(uuid.RFC_4122, id.variant)
+        self.assertTrue(before <= id.int >> 80 <= after + 1)
+
+    def test_iter_pages(self):
+        bfs = [make(BF7, future=i) for i in range(5)]
+        m.create_many(bfs)
+
+        pages = list(m.iter_pages(BF7, '1', page_size=2))
+
+        self.assertEqual(
+            [[0, 1], [2, 3], [4]],
+            [[bf.future for bf in page.objects] for page in pages])
+
+
 class TestException(Exception):
     pass
 
@@ -295,6 +1124,18 @@ class Test_transaction(TestCase):
 
         self.fail('expected TestException was not raised')
 
+    def test_rollback_ends_outermost_transaction(self):
+        try:
+            with db.transaction():
+                insert(A, a='new A')
+                raise TestException()
+        except TestException:
+            pass
+
+        self.assertEqual(0, db.open_transactions)
+        if hasattr(db.connection, 'in_transaction'):
+            self.assertFalse(db.connection.in_transaction)
+
 db2 = Database()
 
 
@@ -366,12 +1207,442 @@ class Test_multiple_databases(unittest.TestCase):
         self.assertRaises(LookupError, m.get, A, a2.id)
 
 
-class Test_table_exists(TestCase):
+cached_db = Database(object_cache_size=2)
 
-    def test_existing_table(self):
-        self.assertTrue(m.table_exists(A))
-        self.assertTrue(m.table_exists(B))
-        self.assertTrue(m.table_exists(AB))
+
+@database(cached_db)
+@table_name('aa')
+@storable_pk_autoinc
+class CachedA(A):
+    pass
+
+
+class Test_object_cache(unittest.TestCase):
+
+    def setUp(self):
+        cached_db.connect(':memory:')
+        cached_db.connection.executescript(
+            '''\
+            create table aa(id integer primary key, a);
+            insert into aa(id, a) values (0, 'A() in db at 0');
+            insert into aa(id, a) values (1, 'A() in db at 1');
+            insert into aa(id, a) values (2, 'A() in db at 2');
+            ''')
+        self.cache = cached_db.object_cache
+        self.cache.hits = self.cache.misses = self.cache.evictions = 0
+
+    def sql_update(self, id, a):
+        cached_db.connection.execute('update aa set a=? where id=?', (a, id))
+
+    def test_get_is_cached(self):
+        a = m.get(CachedA, 0)
+        self.sql_update(0, 'changed behind the cache')
+        a_again = m.get(CachedA, 0)
+
+        self.assertEqual('A() in db at 0', a_again.a)
+        self.assertIsNot(a, a_again)
+        self.assertEqual(1, self.cache.hits)
+        self.assertEqual(1, self.cache.misses)
+
+    def test_filter_fills_cache(self):
+        list(m.filter(CachedA, 'id < 2'))
+        self.sql_update(1, 'changed behind the cache')
+
+        self.assertEqual('A() in db at 1', m.get(CachedA, 1).a)
+        self.assertEqual(1, self.cache.hits)
+
+    def test_get_many_with_fields_on_cache_hit(self):
+        m.get(CachedA, 0)
+        a0, a1 = m.get_many(CachedA, [0, 1], fields=['id'])
+
+        # the missed row is read with the requested fields only
+        self.assertNotIn('a', a1.__dict__)
+        a1.a = 'changed'
+        m.save(a1)
+        self.assertEqual(
+            'changed', cached_db.connection.execute(
+                'select a from aa where id=1').fetchone()[0])
+
+    def test_upsert_replaces_cached_row(self):
+        m.get(CachedA, 1)
+        m.upsert(make(CachedA, id=1, a='upserted'))
+
+        self.assertEqual('upserted', m.get(CachedA, 1).a)
+
+    def test_partial_upsert_evicts(self):
+        m.get(CachedA, 1)
+        m.upsert(make(CachedA, id=1, a='upserted'), fields=[])
+
+        self.assertEqual('A() in db at 1', m.get(CachedA, 1).a)
+        self.assertEqual(0, self.cache.hits)
+
+    def test_least_recently_used_is_evicted(self):
+        m.get(CachedA, 0)
+        m.get(CachedA, 1)
+        m.get(CachedA, 0)
+        m.get(CachedA, 2)
+
+        self.assertEqual(1, self.cache.evictions)
+        self.assertEqual(
+            dict(size=2, length=2, hits=1, misses=3, evictions=1),
+            self.cache.stats())
+        self.sql_update(0, 'changed behind the cache')
+        self.assertEqual('A() in db at 0', m.get(CachedA, 0).a)
+        self.sql_update(1, 'changed behind the cache')
+        self.assertEqual('changed behind the cache', m.get(CachedA, 1).a)
+
+    def test_save_updates_cache(self):
+        a = m.get(CachedA, 0)
+        a.a = 'saved'
+        m.save(a)
+
+        self.assertEqual('saved', m.get(CachedA, 0).a)
+        self.assertEqual(1, self.cache.hits)
+
+    def test_create_fills_cache(self):
+        a = CachedA()
+        a.a = 'created'
+        m.save(a)
+
+        self.assertEqual('created', m.get(CachedA, a.id).a)
+        self.assertEqual(1, self.cache.hits)
+
+    def test_delete_evicts(self):
+        a = m.get(CachedA, 0)
+        m.delete(a)
+
+        self.assertRaises(LookupError, m.get, CachedA, 0)
+
+    def test_rollback_evicts_changes(self):
+        m.get(CachedA, 0)
+        try:
+            with cached_db.transaction():
+                a = m.get(CachedA, 0)
+                a.a = 'rolled back'
+                m.save(a)
+                raise TestException()
+        except TestException:
+            pass
+
+        self.assertEqual('A() in db at 0', m.get(CachedA, 0).a)
+
+    def test_update_where_evicts_table(self):
+        m.get(CachedA, 0)
+        m.update_where(CachedA, {'a': 'updated'}, 'id=0')
+
+        self.assertEqual('updated', m.get(CachedA, 0).a)
+
+    def test_delete_where_evicts_table(self):
+        m.get(CachedA, 0)
+        m.delete_where(CachedA, 'id=0')
+
+        self.assertRaises(LookupError, m.get, CachedA, 0)
+
+    def test_partially_read_objects_are_not_cached(self):
+        a = m.get(CachedA, 0, fields=['id'])
+        self.sql_update(0, 'changed behind the cache')
+
+        self.assertEqual('changed behind the cache', a.a)
+        self.assertEqual('changed behind the cache', m.get(CachedA, 0).a)
+
+    def test_connect_clears_cache(self):
+        m.get(CachedA, 0)
+        cached_db.connect(':memory:')
+
+        self.assertEqual(0, len(self.cache))
+
+
+pooled_db = Database(None, pool_size=2)
+
+
+@database(pooled_db)
+@table_name('aa')
+@storable_pk_autoinc
+class PooledA(A):
+    pass
+
+
+class Test_connection_pool(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        pooled_db.connect(os.path.join(self.tempdir, 'pooled.db'))
+        pooled_db.connection.executescript(
+            '''\
+            create table aa(id integer primary key, a);
+            insert into aa(id, a) values (0, 'A() in db at 0');
+            ''')
+
+    def tearDown(self):
+        pooled_db.close()
+        shutil.rmtree(self.tempdir)
+
+    def in_thread(self, function):
+        results = []
+
+        def run():
+            try:
+                results.append(function())
+            finally:
+                pooled_db.release_connection()
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        result, = results
+        return result
+
+    def test_threads_have_own_connections(self):
+        connection = pooled_db.connection
+
+        self.assertIs(connection, pooled_db.connection)
+        self.assertIsNot(
+            connection, self.in_thread(lambda: pooled_db.connection))
+
+    def test_threads_see_committed_changes(self):
+        m.create(make(PooledA, id=1, a='from main thread'))
+
+        a = self.in_thread(lambda: m.get(PooledA, 1))
+        self.assertEqual('from main thread', a.a)
+
+    def test_transactions_are_per_thread(self):
+        with pooled_db.transaction():
+            self.assertEqual(1, pooled_db.open_transactions)
+            self.assertEqual(
+                0, self.in_thread(lambda: pooled_db.open_transactions))
+
+    def test_released_connection_is_reused(self):
+        connection = self.in_thread(lambda: pooled_db.connection)
+
+        self.assertIs(connection, self.in_thread(lambda: pooled_db.connection))
+
+    def test_threads_wait_for_free_connection(self):
+        pooled_db.connection
+        events = []
+        lock = threading.Lock()
+        lock.acquire()
+
+        def hold_connection():
+            pooled_db.connection
+            events.append('second connection')
+            lock.acquire()
+            pooled_db.release_connection()
+
+        def use_connection():
+            pooled_db.connection
+            events.append('third connection')
+            pooled_db.release_connection()
+
+        holder = threading.Thread(target=hold_connection)
+        holder.start()
+        while not events:
+            time.sleep(0.001)
+        waiter = threading.Thread(target=use_connection)
+        waiter.start()
+        time.sleep(0.05)
+        self.assertEqual(['second connection'], events)
+
+        lock.release()
+        holder.join()
+        waiter.join()
+        self.assertEqual(['second connection', 'third connection'], events)
+
+    def test_concurrent_writes(self):
+        def create_objects():
+            for i in range(20):
+                with pooled_db.transaction():
+                    insert(PooledA, a='from thread')
+
+        threads = [threading.Thread(target=create_objects) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(81, len(list(m.get_all(PooledA))))
+
+    def test_query_started_before_write_does_not_cache_old_row(self):
+        pooled_db.connection.execute('PRAGMA journal_mode=WAL')
+        pooled_db.object_cache = m.ObjectCache(1000)
+        try:
+            m.create_many(
+                make(PooledA, a='old') for _ in range(2 * m.FETCH_BATCH_SIZE))
+            last = make(PooledA, a='old')
+            m.create(last)
+            first_batch_read = threading.Event()
+            written = threading.Event()
+
+            def read_all():
+                try:
+                    objects = m.filter(PooledA, '1 ORDER BY id')
+                    next(objects)
+                    first_batch_read.set()
+                    written.wait()
+                    list(objects)
+                finally:
+                    pooled_db.release_connection()
+            reader = threading.Thread(target=read_all)
+            reader.start()
+            first_batch_read.wait()
+            last.a = 'new'
+            m.save(last)
+            written.set()
+            reader.join()
+
+            self.assertEqual('new', m.get(PooledA, last.id).a)
+        finally:
+            pooled_db.object_cache = None
+
+    def test_closed_database_is_not_usable(self):
+        pooled_db.close()
+
+        self.assertRaises(sqlite3.ProgrammingError, m.get, PooledA, 0)
+
+    def test_memory_database_can_not_be_pooled(self):
+        self.assertRaises(ValueError, Database, ':memory:', pool_size=2)
+
+
+parallel_db = Database(None)
+
+
+@database(parallel_db)
+@table_name('aa')
+@storable_pk_autoinc
+class ParallelA(A):
+    pass
+
+
+# functions run in worker processes must be importable
+def get_a(obj):
+    return obj.a
+
+
+def sum_a(objects):
+    return sum(obj.a for obj in objects)
+
+
+def change_a(obj):
+    obj.a = 'changed'
+    m.save(obj)
+
+
+class Test_parallel_map(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        parallel_db.connect(os.path.join(self.tempdir, 'parallel.db'))
+        m.create_table(ParallelA)
+        m.create_many(make(ParallelA, a=i) for i in range(100))
+
+    def tearDown(self):
+        parallel_db.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_ordered(self):
+        results = m.parallel_map(ParallelA, get_a, 'a % 2 = 0', workers=3)
+
+        self.assertEqual(list(range(0, 100, 2)), list(results))
+
+    def test_unordered(self):
+        results = m.parallel_map(
+            ParallelA, get_a, 'a >= ?', 10, workers=3, ordered=False)
+
+        self.assertEqual(list(range(10, 100)), sorted(results))
+
+    def test_batch(self):
+        sums = list(m.parallel_map(
+            ParallelA, sum_a, '1', workers=2, batch=True))
+
+        self.assertEqual(2 * m.RANGES_PER_WORKER, len(sums))
+        self.assertEqual(sum(range(100)), sum(sums))
+
+    def test_fields(self):
+        results = m.parallel_map(
+            ParallelA, get_a, 'a < 3', workers=2, fields=['id', 'a'])
+
+        self.assertEqual([0, 1, 2], list(results))
+
+    def test_empty_table(self):
+        m.delete_where(ParallelA, '1')
+
+        self.assertEqual([], list(m.parallel_map(ParallelA, get_a, '1')))
+
+    def test_workers_are_read_only(self):
+        results = m.parallel_map(ParallelA, change_a, 'a = 0', workers=1)
+
+        self.assertRaises(sqlite3.OperationalError, list, results)
+
+    def test_memory_database_is_not_supported(self):
+        results = m.parallel_map(A, get_a, '1')
+
+        self.assertRaises(ValueError, list, results)
+
+
+class Test_profiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.dbref = os.path.join(self.tempdir, 'profiled.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_default_settings(self):
+        database = Database(self.dbref)
+        self.assertEqual('delete', database.settings()['journal_mode'])
+        database.close()
+
+    def test_throughput(self):
+        database = Database(self.dbref, profile='throughput')
+        self.assertEqual(
+            dict(
+                busy_timeout=5000,
+                journal_mode='wal',
+                synchronous='normal',
+                cache_size=-64 * 1024,
+                mmap_size=256 * 1024 * 1024,
+                temp_store='memory'),
+            database.settings())
+        database.close()
+
+    def test_durable(self):
+        database = Database(self.dbref, profile='durable')
+        settings = database.settings()
+        self.assertEqual('delete', settings['journal_mode'])
+        self.assertEqual('full', settings['synchronous'])
+        database.close()
+
+    def test_custom_profile(self):
+        database = Database(
+            self.dbref, profile=dict(journal_mode='wal', cache_size=100))
+        settings = database.settings()
+        self.assertEqual('wal', settings['journal_mode'])
+        self.assertEqual(100, settings['cache_size'])
+        database.close()
+
+    def test_pooled_connections_get_profile(self):
+        database = Database(
+            self.dbref, pool_size=2, profile=dict(cache_size=100))
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(database.settings()['cache_size']))
+        thread.start()
+        thread.join()
+        self.assertEqual([100], results)
+        database.close()
+
+    def test_invalid_profiles(self):
+        self.assertRaises(ValueError, Database, profile='fastest')
+        self.assertRaises(ValueError, Database, profile=dict(page_size=1))
+        self.assertRaises(
+            ValueError, Database, profile=dict(journal_mode='wal; drop'))
+
+
+class Test_table_exists(TestCase):
+
+    def test_existing_table(self):
+        self.assertTrue(m.table_exists(A))
+        self.assertTrue(m.table_exists(B))
+        self.assertTrue(m.table_exists(AB))
         self.assertTrue(m.table_exists(F))
 
     def test_nonexisting_table(self):
@@ -425,6 +1696,502 @@ class Test_create_table(unittest.TestCase):
         insert(A, a='A')
 
 
+@m.sql_index('lower(email)', name='users_email_ci_idx')
+@m.sql_index('last_name, first_name')
+@m.sql_index('email', unique=True, where='deleted IS NULL')
+@storable_pk_autoinc
+class User(object):
+    email = Field()
+    first_name = Field()
+    last_name = Field()
+    deleted = Field()
+    team = Field(index=True)
+    nickname = Field(index='unique')
+
+
+def index_names(table_name):
+    sql = '''
+        SELECT name FROM sqlite_master
+        WHERE type='index' AND tbl_name=? AND sql IS NOT NULL'''
+    return sorted(
+        name for name, in db.connection.execute(sql, [table_name]))
+
+
+class Test_indexes(unittest.TestCase):
+
+    def setUp(self):
+        db.connect(':memory:')
+
+    def test_create_table_creates_indexes(self):
+        m.create_table(User)
+
+        self.assertEqual(
+            [
+                'users_email_ci_idx',
+                'users_email_where_1ac94d35_idx',
+                'users_last_name_first_name_idx',
+                'users_nickname_idx',
+                'users_team_idx'],
+            index_names('users'))
+
+    def test_partial_index_does_not_collide_with_field_index(self):
+        @m.sql_index('email', unique=True, where='deleted IS NULL')
+        @storable_pk_autoinc
+        class U(object):
+            email = Field(index=True)
+            deleted = Field()
+        m.create_table(U)
+
+        self.assertEqual(
+            ['us_email_idx', 'us_email_where_1ac94d35_idx'], index_names('us'))
+
+    def test_indexes_with_same_name(self):
+        @storable_pk_autoinc
+        class U(object):
+            email = Field(index=True)
+        m.sql_index('email')(U)
+
+        self.assertEqual(1, len(get_class_meta(U).indexes))
+        self.assertRaises(ValueError, m.sql_index('email', unique=True), U)
+
+    def test_unique_index(self):
+        m.create_table(User)
+        insert(User, nickname='joe')
+
+        self.assertRaises(m.IntegrityError, insert, User, nickname='joe')
+
+    def test_partial_unique_index(self):
+        m.create_table(User)
+        insert(User, email='a@b.c', deleted=1)
+        insert(User, email='a@b.c')
+
+        self.assertRaises(m.IntegrityError, insert, User, email='a@b.c')
+
+    def test_index_is_used(self):
+        m.create_table(User)
+        plan = db.connection.execute(
+            'EXPLAIN QUERY PLAN SELECT * FROM users WHERE last_name=?',
+            ['x']).fetchall()
+
+        self.assertIn('users_last_name_first_name_idx', str(plan))
+
+    def test_ensure_indexes(self):
+        db.connection.execute(
+            '''create table users(
+                id integer primary key,
+                email, first_name, last_name, deleted, team, nickname)''')
+        m.ensure_indexes(User)
+        m.ensure_indexes(User)
+
+        self.assertEqual(5, len(index_names('users')))
+
+
+class Test_hooks(TestCase):
+
+    def setUp(self):
+        super(Test_hooks, self).setUp()
+        self.events = db.add_hook([].append).__self__
+
+    def tearDown(self):
+        for hook in db.hooks:
+            db.remove_hook(hook)
+
+    def operations(self):
+        return [(e.operation, e.table, e.rows) for e in self.events]
+
+    def test_crud_events(self):
+        a = m.get(A, 0)
+        list(m.filter(A, '1'))
+        a.a = 'changed'
+        m.save(a)
+        m.delete(a)
+        m.create(make(A, a='new'))
+
+        self.assertEqual(
+            [('get', 'aa', 1), ('filter', 'aa', 2), ('update', 'aa', 1),
+             ('delete', 'aa', 1), ('create', 'aa', 1)],
+            self.operations())
+        self.assertEqual(['SELECT', 'SELECT', 'UPDATE', 'DELETE', 'INSERT'],
+                         [e.sql.split()[0] for e in self.events])
+        self.assertEqual([0], self.events[0].params)
+        self.assertTrue(all(e.elapsed >= 0 for e in self.events))
+
+    def test_set_based_events(self):
+        m.create_many([make(A, a=1), make(A, a=2)])
+        m.update_where(A, {'a': 3}, 'a < ?', 3)
+
+        self.assertEqual(
+            [('create', 'aa', 2), ('create', 'aa', 1), ('commit', None, 0),
+             ('update', 'aa', 2)],
+            self.operations())
+
+    def test_transaction_events(self):
+        with db.transaction():
+            m.get(A, 0)
+        try:
+            with db.transaction():
+                raise TestException()
+        except TestException:
+            pass
+
+        self.assertEqual(
+            ['get', 'commit', 'rollback'],
+            [e.operation for e in self.events])
+
+    def test_removed_hook_is_not_called(self):
+        db.remove_hook(self.events.append)
+        m.get(A, 0)
+
+        self.assertEqual([], self.events)
+        self.assertEqual((), db.hooks)
+
+    def test_query_stats(self):
+        stats = db.add_hook(m.QueryStats())
+        m.get(A, 0)
+        m.get(A, 1)
+        list(m.filter(A, '1'))
+
+        report = stats.report()
+
+        get = report['aa', 'get']
+        self.assertEqual(2, get['count'])
+        self.assertEqual(2, get['rows'])
+        self.assertEqual(2, sum(get['histogram']))
+        self.assertEqual(1, report['aa', 'filter']['count'])
+
+    def test_slow_query_log(self):
+        class Logger(object):
+            def __init__(self):
+                self.messages = []
+
+            def warning(self, message, *args):
+                self.messages.append(message % args)
+
+        logger = Logger()
+        db.add_hook(m.SlowQueryLog(threshold=0, logger=logger))
+        db.add_hook(m.SlowQueryLog(threshold=60, logger=logger))
+        m.get(A, 0)
+
+        message, = logger.messages
+        self.assertTrue(message.startswith('slow get on aa'))
+
+    def test_default_slow_query_logger(self):
+        self.assertIs(logging.getLogger('omlite'), m.SlowQueryLog().logger)
+
+
+class Test_query_advisor(TestCase):
+
+    def setUp(self):
+        super(Test_query_advisor, self).setUp()
+        self.advisor = db.enable_query_advisor()
+
+    def tearDown(self):
+        db.disable_query_advisor()
+
+    def test_scans_are_reported(self):
+        list(m.filter(A, 'a=?', 'x'))
+        list(m.filter(A, 'a=?', 'y'))
+        list(m.filter(AB, 'a=? and x>?', 'x', 1))
+
+        advice_a, advice_ab = self.advisor.report()
+
+        self.assertEqual('aa', advice_a.table)
+        self.assertEqual('a=?', advice_a.predicate)
+        self.assertEqual(2, advice_a.calls)
+        self.assertTrue(advice_a.plan[0].startswith('SCAN'))
+        self.assertEqual(
+            'CREATE INDEX IF NOT EXISTS aa_a_idx ON aa(a)',
+            advice_a.suggested_index)
+
+        self.assertEqual('x', advice_ab.table)
+        self.assertEqual(
+            'CREATE INDEX IF NOT EXISTS x_a_x_idx ON x(a, x)',
+            advice_ab.suggested_index)
+
+    def test_filter_is_observed_when_iterated(self):
+        objects = m.filter(A, 'a=?', 'x')
+        self.assertEqual([], self.advisor.report())
+
+        list(objects)
+        self.assertEqual(1, len(self.advisor.report()))
+
+    def test_searches_are_not_reported(self):
+        m.get(A, 0)
+        list(m.filter(A, 'id > ?', 0))
+
+        self.assertEqual([], self.advisor.report())
+
+    def test_suggestion_is_correct(self):
+        list(m.filter(A, 'a=?', 'x'))
+        advice, = self.advisor.report()
+
+        db.connection.execute(advice.suggested_index)
+        db.disable_query_advisor()
+        self.advisor = db.enable_query_advisor()
+        list(m.filter(A, 'a=?', 'x'))
+
+        self.assertEqual([], self.advisor.report())
+
+    def test_not_field_is_not_suggested(self):
+        list(m.filter(A, 'length(a) > 3'))
+        advice, = self.advisor.report()
+
+        self.assertIsNone(advice.suggested_index)
+
+
+class Test_export_import(TestCase):
+
+    def export(self, storable_class, format):
+        fileobj = io.BytesIO() if bytes is str else io.StringIO()
+        count = m.export_rows(storable_class, fileobj, format=format)
+        fileobj.seek(0)
+        return count, fileobj
+
+    def test_csv_format(self):
+        count, fileobj = self.export(AB, 'csv')
+
+        self.assertEqual(1, count)
+        self.assertEqual(
+            ['a,b,id,x', ',X() in db at 2,2,'],
+            fileobj.read().splitlines())
+
+    def test_jsonl_format(self):
+        count, fileobj = self.export(A, 'jsonl')
+
+        self.assertEqual(2, count)
+        self.assertEqual(
+            [
+                {'id': 0, 'a': 'A() in db at 0'},
+                {'id': 1, 'a': 'A() in db at 1'}],
+            [json.loads(line) for line in fileobj])
+
+    def round_trip(self, storable_class, format, **kwargs):
+        sql = get_class_meta(storable_class).statements.select_fields
+        sql += ' ORDER BY id'
+        rows = db.connection.execute(sql).fetchall()
+        count, fileobj = self.export(storable_class, format)
+        m.delete_where(storable_class, '1')
+
+        imported = m.import_rows(
+            storable_class, fileobj, format=format, **kwargs)
+
+        self.assertEqual(count, imported)
+        self.assertEqual(rows, db.connection.execute(sql).fetchall())
+
+    def test_csv_round_trip(self):
+        self.round_trip(AB, 'csv')
+        self.round_trip(F, 'csv')
+
+    def test_csv_round_trip_of_numbers(self):
+        m.create_many(
+            make(A, a=value) for value in (1, -2, 0.5, 1e22, 2 ** 40))
+        self.round_trip(A, 'csv')
+
+        self.assertEqual(1, m.get(A, 2).a)
+
+    def test_csv_text_not_written_as_number_is_kept(self):
+        values = ['007', '+1', '1.50', ' 1', 'nan', 'x']
+        m.create_many(make(A, a=value) for value in values)
+        self.round_trip(A, 'csv')
+
+    def test_jsonl_round_trip(self):
+        m.create_many(make(A, a=i) for i in range(10))
+        self.round_trip(A, 'jsonl')
+
+    def test_commit_interval_and_progress(self):
+        m.create_many(make(A, a=i) for i in range(3 * m.BULK_BATCH_SIZE))
+        reports = []
+
+        self.round_trip(
+            A, 'jsonl',
+            commit_interval=m.BULK_BATCH_SIZE,
+            progress=lambda *report: reports.append(report))
+
+        self.assertEqual(
+            [1000, 2000, 3000, 3002], [rows for rows, _, _ in reports])
+
+    def test_binary_uuid_round_trip(self):
+        m.create_table(BF)
+        m.create_many(make(BF, future=i) for i in range(3))
+        self.round_trip(BF, 'csv')
+        self.round_trip(BF, 'jsonl')
+
+        count, fileobj = self.export(BF, 'jsonl')
+        ids = sorted(json.loads(line)['id'] for line in fileobj)
+        self.assertEqual(ids, sorted(bf.id for bf in m.get_all(BF)))
+
+    def test_missing_binary_uuids_are_generated(self):
+        m.create_table(BF)
+        fileobj = io.StringIO(u'{"future": "imported"}\n')
+        m.import_rows(BF, fileobj, format='jsonl')
+
+        bf, = m.filter(BF, 'future=?', 'imported')
+        self.assertEqual(bf.future, m.get(BF, bf.id).future)
+
+    def test_missing_ids_are_generated(self):
+        fileobj = io.StringIO(u'{"future": "imported"}\n')
+        m.import_rows(F, fileobj, format='jsonl')
+
+        f, = m.filter(F, 'future=?', 'imported')
+        self.assertIsNotNone(f.id)
+
+    def test_unknown_field(self):
+        fileobj = io.StringIO(u'{"b": "imported"}\n')
+        self.assertRaises(
+            ValueError, m.import_rows, A, fileobj, format='jsonl')
+
+    def test_unknown_format(self):
+        fileobj = io.StringIO()
+        self.assertRaises(
+            ValueError, m.export_rows, A, fileobj, format='xml')
+        self.assertRaises(
+            ValueError, m.import_rows, A, fileobj, format='xml')
+        self.assertEqual(u'', fileobj.getvalue())
+
+    def test_commit_interval_must_be_positive(self):
+        for commit_interval in (0, -1):
+            fileobj = io.StringIO(u'{"a": "imported"}\n')
+            self.assertRaises(
+                ValueError, m.import_rows, A, fileobj, format='jsonl',
+                commit_interval=commit_interval)
+        self.assertEqual([], list(m.filter(A, 'a=?', 'imported')))
+
+
+@storable_pk_autoinc
+class Attachment(object):
+    name = Field()
+    payload = m.BlobField()
+
+
+has_blobopen = hasattr(sqlite3.Connection, 'blobopen')
+# python 2 stores str as TEXT
+blob = buffer if bytes is str else bytes  # noqa
+
+
+class Test_blob_streaming(TestCase):
+
+    def setUp(self):
+        super(Test_blob_streaming, self).setUp()
+        m.create_table(Attachment)
+        self.payload = bytes(bytearray(range(256))) * 1000
+
+    def stored(self, payload):
+        if isinstance(payload, bytes):
+            payload = blob(payload)
+        attachment = make(Attachment, name='x', payload=payload)
+        m.create(attachment)
+        return attachment
+
+    def test_blob_is_deferred_by_default(self):
+        attachment = self.stored(self.payload)
+
+        read, = m.get_all(Attachment)
+
+        self.assertEqual(
+            frozenset(['payload']), m._get_deferred(read))
+        self.assertEqual(self.payload, bytes(read.payload))
+        read = m.get(Attachment, attachment.id, defer=())
+        self.assertEqual(self.payload, bytes(read.payload))
+
+    def test_blob_size(self):
+        attachment = self.stored(self.payload)
+
+        self.assertEqual(len(self.payload), m.blob_size(attachment, 'payload'))
+
+    def test_iter_blob(self):
+        attachment = self.stored(self.payload)
+
+        chunks = list(m.iter_blob(attachment, 'payload', chunk_size=1000))
+
+        self.assertEqual(256, len(chunks))
+        self.assertTrue(all(isinstance(c, memoryview) for c in chunks))
+        self.assertEqual(
+            self.payload, b''.join(c.tobytes() for c in chunks))
+
+    def test_iter_null_blob(self):
+        attachment = self.stored(None)
+
+        self.assertEqual([], list(m.iter_blob(attachment, 'payload')))
+
+    def test_unknown_field(self):
+        attachment = self.stored(None)
+
+        self.assertRaises(ValueError, m.blob_size, attachment, 'nope')
+
+    @unittest.skipUnless(has_blobopen, 'needs sqlite3 blobopen')
+    def test_create_streams_file_object(self):
+        attachment = self.stored(io.BytesIO(self.payload))
+
+        self.assertEqual(
+            frozenset(['payload']), m._get_deferred(attachment))
+        self.assertEqual(
+            self.payload, m.get(Attachment, attachment.id).payload)
+
+    @unittest.skipUnless(has_blobopen, 'needs sqlite3 blobopen')
+    def test_save_streams_file_object(self):
+        attachment = self.stored(b'old')
+        attachment.payload = io.BytesIO(self.payload)
+        attachment.name = 'new'
+        m.save(attachment)
+
+        read = m.get(Attachment, attachment.id)
+        self.assertEqual('new', read.name)
+        self.assertEqual(self.payload, read.payload)
+
+    def test_save_onto_read_object(self):
+        attachment = self.stored(b'old')
+        read = m.get(Attachment, attachment.id)
+        read.payload = blob(self.payload)
+        m.save(read)
+
+        self.assertEqual(
+            self.payload, bytes(m.get(Attachment, attachment.id).payload))
+
+    @unittest.skipUnless(has_blobopen, 'needs sqlite3 blobopen')
+    def test_save_streams_onto_read_object(self):
+        attachment = self.stored(b'old')
+        read, = m.filter(Attachment, 'id=?', attachment.id)
+        read.payload = io.BytesIO(self.payload)
+        m.save(read)
+
+        self.assertEqual(
+            self.payload, m.get(Attachment, attachment.id).payload)
+
+        # the streamed field is deferred again, but can be saved again
+        read.payload = io.BytesIO(b'newer')
+        m.save(read)
+
+        self.assertEqual(b'newer', m.get(Attachment, attachment.id).payload)
+
+    @unittest.skipUnless(has_blobopen, 'needs sqlite3 blobopen')
+    def test_create_many_streams_file_objects(self):
+        attachments = [
+            make(Attachment, payload=io.BytesIO(self.payload)),
+            make(Attachment, payload=b'small')]
+        m.create_many(attachments)
+
+        self.assertEqual(
+            [self.payload, b'small'],
+            [m.get(Attachment, a.id).payload for a in attachments])
+
+    @unittest.skipUnless(has_blobopen, 'needs sqlite3 blobopen')
+    def test_open_blob(self):
+        attachment = self.stored(self.payload)
+
+        with m.open_blob(attachment, 'payload') as blob:
+            self.assertEqual(len(self.payload), len(blob))
+            self.assertEqual(self.payload[10:20], blob[10:20])
+
+    @unittest.skipUnless(has_blobopen, 'needs sqlite3 blobopen')
+    def test_short_stream_is_rolled_back(self):
+        attachment = self.stored(b'old')
+
+        self.assertRaises(
+            ValueError,
+            m.write_blob, attachment, 'payload', io.BytesIO(b'xy'), size=3)
+        self.assertEqual(b'old', m.get(Attachment, attachment.id).payload)
+
+
 class PlainA(object):
     def __init__(self):
         super(PlainA, self).__init__()
@@ -446,5 +2213,227 @@ class Test_super_in_subclass(TestCase):
         self.assertTrue(sa.a_init)
 
 
+try:
+    import enum
+except ImportError:
+    enum = None
+else:
+    class Color(enum.Enum):
+        red = 'r'
+        green = 'g'
+
+
+@storable_pk_autoinc
+class Typed(object):
+    at = m.DateTimeField()
+    price = m.DecimalField()
+    doc = m.JSONField()
+    flag = m.BoolField()
+    color = m.EnumField(Color) if enum else Field()
+    plain = Field()
+
+
+class Test_typed_fields(TestCase):
+
+    def setUp(self):
+        super(Test_typed_fields, self).setUp()
+        m.create_table(Typed)
+        self.typed = make(
+            Typed,
+            at=datetime.datetime(2015, 3, 1, 12, 30, 5, 123),
+            price=decimal.Decimal('10.10'),
+            doc={'b': [1, 2], 'a': None},
+            flag=True,
+            plain='plain')
+        if enum:
+            self.typed.color = Color.green
+        m.create(self.typed)
+
+    def stored(self, field):
+        sql = 'SELECT {} FROM typeds WHERE id=?'.format(field)
+        return db.connection.execute(sql, [self.typed.id]).fetchone()[0]
+
+    def test_values_are_stored_converted(self):
+        self.assertEqual('2015-03-01 12:30:05.000123', self.stored('at'))
+        self.assertEqual('10.10', self.stored('price'))
+        self.assertEqual('{"a": null, "b": [1, 2]}', self.stored('doc'))
+        self.assertEqual(1, self.stored('flag'))
+
+    def test_values_are_read_converted(self):
+        typed = m.get(Typed, self.typed.id)
+
+        self.assertEqual(self.typed.at, typed.at)
+        self.assertEqual(decimal.Decimal('10.10'), typed.price)
+        self.assertEqual({'b': [1, 2], 'a': None}, typed.doc)
+        self.assertIs(True, typed.flag)
+        self.assertEqual('plain', typed.plain)
+
+    def test_none_is_not_converted(self):
+        typed = make(Typed, flag=None)
+        m.create(typed)
+
+        self.assertIsNone(m.get(Typed, typed.id).flag)
+        self.assertFalse(m.is_dirty(m.get(Typed, typed.id)))
+
+    def test_in_place_change_is_dirty(self):
+        typed = m.get(Typed, self.typed.id)
+        self.assertFalse(m.is_dirty(typed))
+
+        typed.doc['c'] = 3
+
+        self.assertEqual(('doc',), m.changed_fields(typed))
+        m.save(typed)
+        self.assertEqual(3, m.get(Typed, typed.id).doc['c'])
+
+    def test_invalid_value(self):
+        typed = make(Typed, at='2015-03-01')
+
+        self.assertRaises(TypeError, m.create, typed)
+
+    @unittest.skipIf(enum is None, 'enum is not available')
+    def test_enum(self):
+        self.assertEqual('g', self.stored('color'))
+        self.assertIs(Color.green, m.get(Typed, self.typed.id).color)
+
+        typed = make(Typed, color='x')
+        self.assertRaises(ValueError, m.create, typed)
+
+    def test_update_where_converts(self):
+        m.update_where(Typed, {'flag': False}, 'id=?', self.typed.id)
+
+        self.assertEqual(0, self.stored('flag'))
+
+    def test_deferred_field_is_converted(self):
+        typed = m.get(Typed, self.typed.id, defer=['price'])
+
+        self.assertEqual(decimal.Decimal('10.10'), typed.price)
+
+    def test_object_cache(self):
+        cached_db = Database(object_cache_size=2)
+        get_class_meta(Typed).database = cached_db
+        try:
+            m.create_table(Typed)
+            typed = make(Typed, price=decimal.Decimal('1.5'))
+            m.create(typed)
+
+            self.assertEqual(
+                decimal.Decimal('1.5'), m.get(Typed, typed.id).price)
+        finally:
+            get_class_meta(Typed).database = db
+
+
+@m.compact
+@table_name('x')
+@storable_pk_autoinc
+class CompactAB(object):
+    a = Field()
+    b = Field()
+    x = Field()
+
+    def ab(self):
+        return self.a, self.b
+
+
+class Test_compact(TestCase):
+
+    def test_objects_have_no_dict(self):
+        ab = m.get(CompactAB, 2)
+
+        self.assertFalse(hasattr(ab, '__dict__'))
+        self.assertRaises(AttributeError, setattr, ab, 'other', 1)
+        self.assertEqual((None, 'X() in db at 2'), ab.ab())
+
+    def test_new_object_fields_are_initialized(self):
+        ab = CompactAB()
+
+        self.assertEqual((None, None), ab.ab())
+        self.assertIsNone(ab.id)
+
+    def test_crud(self):
+        ab = make(CompactAB, a='a', b='b')
+        m.create(ab)
+        ab.x = 'x'
+        m.save(ab)
+        m.create_many([make(CompactAB, a='many')])
+
+        read = m.get(CompactAB, ab.id)
+        self.assertEqual(('a', 'b', 'x'), (read.a, read.b, read.x))
+        self.assertEqual(
+            ['X() in db at 2', 'b', None],
+            [o.b for o in m.filter(CompactAB, '1 ORDER BY id')])
+
+        m.delete(read)
+        self.assertRaises(LookupError, m.get, CompactAB, ab.id)
+
+    def test_dirty_tracking(self):
+        ab = m.get(CompactAB, 2)
+        self.assertFalse(m.is_dirty(ab))
+
+        ab.a = 'changed'
+        self.assertEqual(['a'], list(m.changed_fields(ab)))
+
+    def test_projection_is_refused(self):
+        self.assertRaises(ValueError, m.get, CompactAB, 2, fields=['a'])
+
+    def test_original_class_is_unchanged(self):
+        ab = m.get(AB, 2)
+
+        self.assertTrue(hasattr(ab, '__dict__'))
+        self.assertFalse(get_class_meta(AB).compact)
+
+    def test_base_class_without_slots(self):
+        @storable_pk_autoinc
+        class Base(object):
+            pass
+
+        class Derived(Base):
+            pass
+
+        self.assertRaises(TypeError, m.compact, storable_pk_autoinc(Derived))
+
+
+class Test_reading_objects(TestCase):
+
+    def test_init_is_bypassed(self):
+        db.connection.execute('create table sas(id integer primary key)')
+        insert(SA)
+
+        sa, = m.get_all(SA)
+        self.assertFalse(hasattr(sa, 'sa_init'))
+        self.assertFalse(hasattr(sa, 'a_init'))
+
+    def test_construct_with_init(self):
+        @m.construct_with_init
+        @m.table_name('sas')
+        @storable_pk_autoinc
+        class SAInit(SA):
+            pass
+
+        db.connection.execute('create table sas(id integer primary key)')
+        insert(SAInit)
+
+        sa, = m.get_all(SAInit)
+        self.assertTrue(sa.sa_init)
+        self.assertTrue(sa.a_init)
+
+    def test_fields_missing_from_table_are_none(self):
+        db.connection.execute('create table bs2(id integer primary key)')
+        db.connection.execute('insert into bs2(id) values (1)')
+
+        @table_name('bs2')
+        @storable_pk_autoinc
+        class B2(B):
+            pass
+
+        b = m.get(B2, 1)
+        self.assertIsNone(b.b)
+
+    def test_many_rows(self):
+        count = 3 * m.FETCH_BATCH_SIZE + 1
+        m.create_many(make(A, a=i) for i in range(count))
+
+        self.assertEqual(count + 2, len(list(m.get_all(A))))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -27,5 +27,5 @@ setup(
     ],
     license='Unlicense',
 
-    py_modules=['omlite'],
+    py_modules=['omlite', 'omlite_async'],
 )